@@ -1,13 +1,34 @@
 from collections import OrderedDict
 from datetime import datetime
-from sense_hat import (SenseHat        , DIRECTION_UP    , DIRECTION_DOWN   ,
-                       DIRECTION_LEFT  , DIRECTION_RIGHT , DIRECTION_MIDDLE ,
-                       ACTION_RELEASED , ACTION_PRESSED)
-from time import sleep
-from threading import Thread
+from time import monotonic, perf_counter
+from threading import Thread, Event
+from backends import load_backend
+from scheduler import Scheduler, SKIP
+from writer import StreamWriter, ProcessWriter, FSYNC_CLOSE
+from formats import get_format
+from segments import FileOutput, SegmentedOutput
+from stats import Stats, StatsReporter
+from aggregate import Aggregator, aggregate_columns
+from trigger import Trigger, accel_columns
+from spectrum import Spectrum, spectrum_columns, default_bands, level_heights
+from schema import Schema, sensor_letters
+import json
+import math
+import socket
 import sys
 import os
 
+# The Sense HAT, its emulator or the fake device, see backends.py
+backend = load_backend()
+SenseHat         = backend.SenseHat
+DIRECTION_UP     = backend.DIRECTION_UP
+DIRECTION_DOWN   = backend.DIRECTION_DOWN
+DIRECTION_LEFT   = backend.DIRECTION_LEFT
+DIRECTION_RIGHT  = backend.DIRECTION_RIGHT
+DIRECTION_MIDDLE = backend.DIRECTION_MIDDLE
+ACTION_RELEASED  = backend.ACTION_RELEASED
+ACTION_PRESSED   = backend.ACTION_PRESSED
+
 # Different colors
 y = (255,255,0) # Yellow
 r = (255,0,0)   # Red
@@ -20,17 +41,23 @@ _ = (0,0,0)     # No color
 # Scroll speed
 ss = 0.03
 
+# Symbol of the joystick directions
+navigation = [_,_,_,_,_,_,_,_,
+              _,_,_,g,_,_,_,_,
+              _,_,g,g,g,_,_,_,
+              _,y,_,g,_,v,_,_,
+              y,y,y,r,v,v,v,_,
+              _,y,_,b,_,v,_,_,
+              _,_,b,b,b,_,_,_,
+              _,_,_,b,_,_,_,_]
+
 class DataCollector(SenseHat):
 
-    def __init__(self):
+    def __init__(self, interactive=True):
+        """ Sets up the DataCollector. If interactive is False the welcome message and
+        the main menu are skipped, so the session can be set up from code. """
         super().__init__()
-        self.sensors = OrderedDict([["A", False],
-                                   ["T", False],
-                                   ["P", False],
-                                   ["H", False],
-                                   ["G", False],
-                                   ["O", False],
-                                   ["M", False]])
+        self.sensors = OrderedDict((sensor, False) for sensor in sensor_letters)
         self.menu = [sensor for sensor in self.sensors.keys()]
         self.menu.append("S")
         self.menu.append("Q")
@@ -38,127 +65,350 @@ class DataCollector(SenseHat):
         self.menu_index = 0
         self.write_freq = 20 # Number of collections
         self.delay = 0.3  # Time between collections
+        self.duration = 0 # Maximum length of a collection in seconds, 0 has no limit
+        self.display = True # Show messages and the progress on the LED matrix
+        self.display_rate = 20 # Most frames per second drawn on the LED matrix during a collection
+        self.renderer = None # The Renderer that draws on the LED matrix during a collection, see display.py
+        self.stop_event = Event() # Stops a running collection when set
+        # Runs the collection with threads, as asyncio tasks, or with threads and the
+        # writer in its own process ("threads", "asyncio" or "processes")
+        self.engine = "threads"
+        self.async_engine = None # The AsyncEngine of a running asyncio collection
+        self.overrun_policy = SKIP # What to do when a collection misses its deadline ("skip" or "catchup")
+        # Sampling rate in Hz for sensors that should be read less often than every collection,
+        # e.g. {"T": 1, "P": 1, "H": 1}. Sensors that are not listed are read at every collection
+        self.rates = {}
+        self.next_read = {} # Time of the next read for the sensors listed in self.rates
+        self.buffer_size = 1000 # Number of collections that can wait to be written to the data file
+        self.flush_interval = 1.0 # Time between writes to the data file
+        self.fsync = FSYNC_CLOSE # When the data file is synced to the SD card ("never", "flush" or "close")
         self.file_name = "SenseLogger.csv" # Default file name for data files. Is renamed later
-        self.show_message("Welcome to DataCollector", scroll_speed=ss)
-        self.main_menu()
+        self.output_dir = "" # Directory the data files are written to
+        self.stats = Stats() # Latency histograms of the sensor reads, collections and writes
+        self.stats_interval = 1.0 # Time between updates of the live stats file, 0 turns it off
+        self.stats_socket = None # Path of a Unix socket that serves the live stats
+        self.file_format = "csv" # Format of the data files ("csv" or "binary")
+        # Splits the data into segment files, see segments.py. The data is written to
+        # a single file if none of these are set
+        self.compression = None # Compression of the segments (None, "gzip" or "lzma")
+        self.segment_size = 0 # Bytes on disk before a new segment is started, 0 has no limit
+        self.segment_time = 0 # Seconds of data before a new segment is started, 0 has no limit
+        # Writes the mean, min, max, std and count of every column per window of this many seconds
+        # instead of every collection, see aggregate.py. 0 writes every collection
+        self.window = 0
+        self.raw_ring = 0 # Number of raw collections kept in memory while aggregating
+        # Only writes the collections from trigger_pre seconds before to trigger_post seconds after the
+        # magnitude of trigger_columns reaches this value, see trigger.py. 0 writes every collection
+        self.trigger = 0
+        self.trigger_pre = 1.0
+        self.trigger_post = 1.0
+        self.trigger_columns = accel_columns
+        # Also sends the data to the collector at this "HOST:PORT", see network.py. None only writes it locally
+        self.server = None
+        self.unit = socket.gethostname() # Name of this unit on the collector
+        self.network_backlog = 64e6 # Bytes kept for the collector while it can not be reached
+        # Writes the band energies and peak frequencies of the accelerometer and gyroscope per window
+        # of this many seconds instead of every collection, see spectrum.py. 0 writes every collection
+        self.spectrum = 0
+        self.spectrum_bands = default_bands # (low, high) frequency bands in Hz
+        self.spectrum_levels = False # Shows the vibration level of every channel on the LED matrix
+        self.stage = None # The Aggregator, Trigger or Spectrum of the running collection
+        # Last valid IMU readings. Used when the IMU does not return a valid value
+        self.last_imu = {"accel": (0, 0, 0),
+                         "gyro": (0, 0, 0),
+                         "orientation": (0, 0, 0),
+                         "compass": (0, 0, 0)}
+        if interactive:
+            self.show_message("Welcome to DataCollector", scroll_speed=ss)
+            self.main_menu()
 
     def file_setup(self):
         # Setup file name
-        enabled_detectors = [sensor for sensor in self.sensors if self.sensors[sensor]]
-        self.file_name = "".join(enabled_detectors)+"-"+str(datetime.now().replace(microsecond=0))+".csv"
+        file_format = get_format(self.file_format)
+        # The columns of a collection and their readers, see schema.py
+        self.schema = Schema([sensor for sensor in self.sensors if self.sensors[sensor]])
+        self.readers = self.schema.compile(self)
+        created = str(datetime.now().replace(microsecond=0))
+        self.file_name = os.path.join(self.output_dir, self.schema.letters+"-"+created+file_format.extension)
 
         # Setup header in file
-        header = []
-        header.append("time")
-        if self.sensors["A"]:
-            header.extend(["accel_x", "accel_y", "accel_z"])
-        if self.sensors["T"]:
-            header.append("temp")
-        if self.sensors["P"]:
-            header.append("pressure")
-        if self.sensors["H"]:
-            header.append("humidity")
-        if self.sensors["G"]:
-            header.extend(["gyro_x", "gyro_y", "gyro_z"])
-        if self.sensors["O"]:
-            header.extend(["pitch", "roll", "yaw"])
-        if self.sensors["M"]:
-            header.extend(["mag_x", "mag_y", "mag_z"])
-        with open(self.file_name,"w") as f:
-            f.write(" , ".join(str(value) for value in header) + "\n")
+        header = self.schema.columns
+        self.columns = header # Columns of the data file
+        self.file_info = {"sensors": self.schema.letters, "created": created}
+        if self.window:
+            self.columns = aggregate_columns(header)
+            self.file_info["window"] = self.window
+        if self.trigger:
+            self.file_info["trigger"] = {"threshold": self.trigger,
+                                         "pre": self.trigger_pre,
+                                         "post": self.trigger_post,
+                                         "columns": self.trigger_columns}
+        if self.spectrum:
+            self.columns = spectrum_columns(header, self.spectrum_bands)
+            self.file_info["spectrum"] = {"window": self.spectrum,
+                                          "bands": [list(band) for band in self.spectrum_bands]}
+        # Segments get their header from the writer
+        if not self.segmented():
+            with open(self.file_name,"wb" if file_format.binary else "w") as f:
+                f.write(file_format.header(self.columns, self.file_info))
 
-    def get_sense_data(self, start_time):
-        """ Returns a list with data from the selected detectors. """
-        sense_data = []
-        sense_data.append((datetime.now()-start_time).total_seconds())
+    def segmented(self):
+        """ Returns True if the data is split into segment files """
+        return bool(self.compression or self.segment_size or self.segment_time)
+
+    def read_imu(self):
+        """ Reads the IMU once and returns the accelerometer, gyroscope, orientation and compass values.
+
+        The separate get_*_raw and get_orientation methods poll the IMU once each,
+        so reading all four of them costs four IMU reads per sample. """
+        if not hasattr(self, "_read_imu"):
+            # The backend does not expose the IMU, so each sensor is read by itself
+            return self._read_imu_separately()
+        if self._read_imu():
+            data = self._imu.getIMUData()
+            if data["accelValid"]:
+                self.last_imu["accel"] = tuple(data["accel"])
+            if data["gyroValid"]:
+                self.last_imu["gyro"] = tuple(data["gyro"])
+            if data["fusionPoseValid"]:
+                # The fusion pose is (roll, pitch, yaw) in radians, the sense hat reports degrees in [0, 360)
+                roll, pitch, yaw = (math.degrees(angle) % 360 for angle in data["fusionPose"])
+                self.last_imu["orientation"] = (pitch, roll, yaw)
+            if data["compassValid"]:
+                self.last_imu["compass"] = tuple(data["compass"])
+        return self.last_imu
+
+    def _read_imu_separately(self):
+        """ Reads the enabled IMU sensors with one call each """
         if self.sensors["A"]:
             acc = self.get_accelerometer_raw()
-            x = acc["x"]
-            y = acc["y"]
-            z = acc["z"]
-            sense_data.extend([x,y,z])
-        if self.sensors["T"]:
-            sense_data.append(self.get_temperature())
-        if self.sensors["P"]:
-            sense_data.append(self.get_pressure())
-        if self.sensors["H"]:
-            sense_data.append(self.get_humidity())
+            self.last_imu["accel"] = (acc["x"], acc["y"], acc["z"])
         if self.sensors["G"]:
             gyro = self.get_gyroscope_raw()
-            gyro_x = gyro["x"]
-            gyro_y = gyro["y"]
-            gyro_z = gyro["z"]
-            sense_data.extend([gyro_x, gyro_y, gyro_z])
+            self.last_imu["gyro"] = (gyro["x"], gyro["y"], gyro["z"])
         if self.sensors["O"]:
             orien = self.get_orientation()
-            pitch = orien["pitch"]
-            roll = orien["roll"]
-            yaw = orien["yaw"]
-            sense_data.extend([pitch, roll, yaw])
+            self.last_imu["orientation"] = (orien["pitch"], orien["roll"], orien["yaw"])
         if self.sensors["M"]:
             mag = self.get_compass_raw()
-            mag_x = mag["x"]
-            mag_y = mag["y"]
-            mag_z = mag["z"]
-            sense_data.extend([mag_x, mag_y, mag_z])
+            self.last_imu["compass"] = (mag["x"], mag["y"], mag["z"])
+        return self.last_imu
+
+    def _is_due(self, sensor, now):
+        """ Returns True if the sensor should be read at this collection according to self.rates """
+        rate = self.rates.get(sensor)
+        if not rate:
+            return True
+        due = self.next_read.get(sensor, now)
+        if now < due:
+            return False
+        # Keeps the reads of the sensor on a fixed grid unless it has fallen behind
+        self.next_read[sensor] = max(due + 1.0/rate, now)
+        return True
+
+    def get_sense_data(self, start_time):
+        """ Returns a list with data from the selected detectors.
+
+        The readers are compiled from the schema by file_setup. Sensors that are
+        not due according to self.rates are returned as NaN. """
+        sense_data = [(datetime.now()-start_time).total_seconds()]
+        for read in self.readers:
+            read(sense_data)
         return sense_data
 
-    def log_data(self,data_list,start_time):
-        """ Appends collected data to a data list. """
-        sense_data = self.get_sense_data(start_time)
-        output_string = ",".join(str(value) for value in sense_data)
-        data_list.append(output_string)
+    def _timed_read(self, name, read):
+        """ Calls read and records how long it took """
+        start = perf_counter()
+        value = read()
+        self.stats.record(name, perf_counter() - start)
+        return value
+
+    def log_data(self,writer,start_time):
+        """ Passes collected data to the writer, which formats it for the data file. """
+        start = perf_counter()
+        writer.write(self.get_sense_data(start_time))
+        self.stats.record("collection", perf_counter() - start)
 
     def collect_data(self):
-        self.show_message("Collecting data", scroll_speed=ss)
-        batch_data = []
+        writer = self.open_writer(start=False)
         start_time = datetime.now()
+        self.next_read = {}
+        self.stop_event.clear()
+        scheduler = Scheduler(self.delay, self.overrun_policy)
+        reporter = None
+        try:
+            # Started in the try, so the writer is also closed when the display or the reporter fails to start
+            if self.display:
+                self.start_renderer()
+                self.renderer.message("Collecting data", scroll_speed=ss)
+            reporter = self.start_reporter(scheduler, writer, start_time)
+            if self.engine == "asyncio":
+                # The asyncio engine drives the writer itself
+                self._async_collect_data(writer, start_time, scheduler)
+            else:
+                writer.start()
+                self._collect_data(writer, start_time, scheduler)
+        finally:
+            try:
+                writer.close()
+            finally:
+                # Also runs when the writer failed, so the summary records the failed session
+                if reporter is not None:
+                    reporter.stop()
+                if self.renderer is not None:
+                    self.renderer.stop()
+                self._write_summary(scheduler, writer, start_time)
+                self.renderer = None
+
+    def stop(self):
+        """ Stops a running collection. Can be called from other threads and signal handlers """
+        self.stop_event.set()
+        if self.async_engine is not None:
+            self.async_engine.stop()
+
+    def open_writer(self, start=True):
+        """ Starts a writer for the data file set up by file_setup """
+        self.stats = Stats()
+        file_format = get_format(self.file_format)
+        output = None
+        if self.segmented():
+            output = SegmentedOutput(self.file_name, file_format, self.columns, self.file_info,
+                                     self.compression, self.segment_size, self.segment_time)
+        if self.server:
+            from network import NetworkOutput, parse_address
+            if output is None:
+                output = FileOutput(self.file_name)
+            session = os.path.splitext(os.path.basename(self.file_name))[0]
+            output = NetworkOutput(parse_address(self.server), self.unit, session, file_format,
+                                   self.columns, self.file_info, output, self.network_backlog)
+        self.stage = None
+        if bool(self.window) + bool(self.trigger) + bool(self.spectrum) > 1:
+            raise ValueError("Only one of aggregation, triggers and spectra can be used")
+        if self.window:
+            self.stage = Aggregator(self.schema.width, self.window, self.raw_ring)
+        if self.trigger:
+            self.stage = Trigger(self.schema.columns, self.trigger, self.trigger_pre, self.trigger_post, self.trigger_columns)
+        if self.spectrum:
+            # The levels are drawn by the renderer of this process, so the processes engine does not show them
+            show = self.spectrum_levels and self.display and self.engine != "processes"
+            self.stage = Spectrum(self.schema.columns, self.spectrum, self.spectrum_bands,
+                                  self._show_levels if show else None)
+        # The processes engine formats and writes the data in a process of its own
+        writer_class = ProcessWriter if self.engine == "processes" else StreamWriter
+        writer = writer_class(self.file_name, self.schema.width, self.buffer_size, self.flush_interval, self.fsync,
+                              file_format=file_format, stats=self.stats, output=output, stage=self.stage)
+        if start:
+            writer.start()
+        return writer
+
+    def start_renderer(self):
+        """ Starts drawing on the LED matrix from its own thread so it never delays a collection """
+        from display import Renderer
+        self.renderer = Renderer(self, self.display_rate, self.stats)
+        self.renderer.start()
+        return self.renderer
+
+    def start_reporter(self, scheduler, writer, start_time):
+        """ Starts publishing the live statistics of the session, if it is turned on """
+        if not self.stats_interval and not self.stats_socket:
+            return None
+        file_name = os.path.splitext(self.file_name)[0] + ".stats.json" if self.stats_interval else None
+        reporter = StatsReporter(lambda: self._session_stats(scheduler, writer, start_time),
+                                 file_name, self.stats_socket, self.stats_interval or 1.0)
+        reporter.start()
+        return reporter
+
+    def _collect_data(self, writer, start_time, scheduler):
+
+        # Without the display the collection runs in this thread until it is done or stopped
+        if not self.display:
+            self._thread_collect_data(writer, start_time, scheduler)
 
         # Runs collection of data until the joystick is activated
         # Shows the navigation symbol on the display
         # Is activated if the number of collections is set to zero
-        if not self.write_freq:
+        elif not self.write_freq:
             self._show_navigation()
-            thread = Thread(target=self._thread_wait_for_movement)
+            thread = Thread(target=self._thread_wait_for_movement, daemon=True)
             thread.start()
-            while thread.is_alive():
-                self.log_data(batch_data, start_time)
-                sleep(self.delay)
+            self._thread_collect_data(writer, start_time, scheduler)
         else:
-            thread_collect = Thread(target=self._thread_collect_data,args=(batch_data,start_time))
+            thread_collect = Thread(target=self._thread_collect_data,args=(writer,start_time,scheduler))
             thread_collect.start()
 
             pn = 0 # Used in the annimation below
             while thread_collect.is_alive():
-                # Makes an annimation of a dot moving across the display of the sensehat
-                # if there is more than 9 collections left
-                number = self.write_freq - len(batch_data)
-                if number > 9:
-                    self.clear()
-                    self.set_pixel(pn,4,w)
-                    pn = (pn + 1) % 8
-                else:
-                    # Shows the number of collections left
-                    self.show_letter(str(number))
-                sleep(self.delay)
-
-        self._write_data(batch_data)
-
-    def _thread_collect_data(self,batch_data, start_time):
-        while True:
-            self.log_data(batch_data, start_time)
-            if len(batch_data) >= self.write_freq:
+                pn = self._show_progress(writer.rows, pn)
+                # Never faster than the renderer draws, so a delay of 0 does not spin
+                thread_collect.join(max(self.delay, 1.0 / self.display_rate if self.display_rate else 0.05))
+
+    def _async_collect_data(self, writer, start_time, scheduler):
+        """ Runs the collection as asyncio tasks, see engine.py """
+        import asyncio
+        from engine import AsyncEngine
+        self.async_engine = AsyncEngine(self, writer, start_time, scheduler)
+        try:
+            asyncio.run(self.async_engine.run())
+        finally:
+            self.async_engine = None
+
+    def _show_levels(self, levels):
+        """ Shows the vibration level of every spectrum channel as a bar. Called by the writer """
+        if self.renderer is not None:
+            self.renderer.bars(level_heights(self.stage.channels, levels), y)
+
+    def _show_progress(self, rows, pn):
+        """ Shows the progress of a collection and returns the next position of the dot """
+        if self.spectrum and self.spectrum_levels and self.engine != "processes":
+            # The matrix shows the vibration levels instead
+            return pn
+        # Makes an annimation of a dot moving across the display of the sensehat
+        # if there is more than 9 collections left
+        number = self.write_freq - rows
+        if number > 9:
+            self.renderer.dot(pn,4,w)
+            pn = (pn + 1) % 8
+        else:
+            # Shows the number of collections left
+            self.renderer.letter(str(number))
+        return pn
+
+    def _thread_collect_data(self,writer, start_time, scheduler):
+        """ Collects data until write_freq collections are done, the duration has passed or stop_event is set """
+        end = monotonic() + self.duration if self.duration else None
+        while not self.stop_event.is_set():
+            scheduler.wait(self.stop_event)
+            if self.stop_event.is_set():
+                break
+            self.log_data(writer, start_time)
+            if self.write_freq and writer.rows >= self.write_freq:
+                break
+            if end is not None and monotonic() >= end:
                 break
-            sleep(self.delay)
 
     def _thread_wait_for_movement(self):
         self.stick.wait_for_event(emptybuffer=True)
+        self.stop_event.set()
+
+    def _session_stats(self, scheduler, writer, start_time):
+        """ Returns the timing, writer and latency statistics of the session """
+        duration = (datetime.now()-start_time).total_seconds()
+        return {"file": self.file_name,
+                "start_time": str(start_time),
+                "samples": writer.rows,
+                "duration": duration,
+                "sample_rate": writer.rows / duration if duration else 0.0,
+                "rates": self.rates,
+                "timing": scheduler.stats(),
+                "writer": writer.stats(),
+                "error": repr(writer.error) if writer.error is not None else None,
+                "latency": self.stats.snapshot(),
+                "display": self.renderer.stats() if self.renderer is not None else None}
 
-    def _write_data(self,batch_data):
-        """ Writes batch data to the data file """
-        with open(self.file_name,"a") as f:
-            for line in batch_data:
-                f.write(line + "\n")
+    def _write_summary(self, scheduler, writer, start_time):
+        """ Writes the statistics of the session next to the data file """
+        with open(os.path.splitext(self.file_name)[0] + ".json", "w") as f:
+            json.dump(self._session_stats(scheduler, writer, start_time), f, indent=2)
 
     def _change_parameter(self, param, param_name, incr_size=0.1):
         """ Internal method used to change either the number of collections or the delay between collections """
@@ -190,14 +440,10 @@ class DataCollector(SenseHat):
 
 
     def _show_navigation(self):
-        self.set_pixels([_,_,_,_,_,_,_,_,
-                         _,_,_,g,_,_,_,_,
-                         _,_,g,g,g,_,_,_,
-                         _,y,_,g,_,v,_,_,
-                         y,y,y,r,v,v,v,_,
-                         _,y,_,b,_,v,_,_,
-                         _,_,b,b,b,_,_,_,
-                         _,_,_,b,_,_,_,_])
+        if self.renderer is not None:
+            self.renderer.pixels(navigation)
+        else:
+            self.set_pixels(navigation)
 
 
     def choose_delay(self):
@@ -0,0 +1,154 @@
+""" Statistics of the collections per time window.
+
+For long runs the data file does not need every collection. With a window set,
+the writer passes the collected rows through an Aggregator instead of writing
+them, and writes one row per window with the mean, minimum, maximum, standard
+deviation and number of values of every column:
+
+    time , accel_x_mean , accel_x_min , accel_x_max , accel_x_std , accel_x_count , ...
+
+The time of a row is the start of its window. NaN values, i.e. sensors that were
+not read in a collection, are left out, so a column that was not read at all in
+a window has a count of 0. The last raw collections can be kept in memory,
+and are listed under "recent" in the statistics, so they can be read from
+the live stats while the collection runs and from the summary at the end.
+"""
+from array import array
+from bisect import bisect_left
+from operator import mul
+from threading import Lock
+import math
+
+statistics = ["mean", "min", "max", "std", "count"]
+
+nan = float("nan")
+
+def aggregate_columns(columns):
+    """ Returns the columns of the aggregated data for the given raw columns. """
+    return [columns[0]] + ["{}_{}".format(column, statistic) for column in columns[1:] for statistic in statistics]
+
+class Aggregator:
+    """ Sums up flat rows of width values, the first being the time, per window of seconds. """
+
+    def __init__(self, width, window, raw_size=0):
+        if window <= 0:
+            raise ValueError("The window must be longer than 0 seconds")
+        self.width = width # Values in a raw row
+        self.out_width = 1 + (width - 1) * len(statistics) # Values in an aggregated row
+        self.window = window
+        self.key = None # Number of the current window
+        self.rows = 0 # Raw rows added
+        self.windows = 0 # Aggregated rows returned
+        self._reset(None)
+        # The last raw_size rows, kept for inspection while the raw data is not written
+        self.raw_size = raw_size
+        self.raw = array("d", bytes(8 * width * raw_size))
+        self.raw_rows = 0 # Rows put into the raw ring
+        self.lock = Lock()
+
+    def _reset(self, key):
+        columns = self.width - 1
+        self.key = key
+        self.count = [0] * columns
+        self.total = [0.0] * columns
+        self.squares = [0.0] * columns
+        self.low = [math.inf] * columns
+        self.high = [-math.inf] * columns
+
+    def add(self, values):
+        """ Adds flat rows and returns the aggregated rows of the windows they completed. """
+        width = self.width
+        rows = len(values) // width
+        out = array("d")
+        if not rows:
+            return out
+        if self.raw_size:
+            self._keep(values, rows)
+        times = values[0::width]
+        start = 0
+        while start < rows:
+            key = math.floor(times[start] / self.window)
+            if key != self.key:
+                if self.key is not None:
+                    self._emit(out)
+                self._reset(key)
+            end = bisect_left(times, (key + 1) * self.window, start)
+            self._accumulate(values, start, end)
+            start = end
+        self.rows += rows
+        return out
+
+    def _accumulate(self, values, start, end):
+        """ Adds the rows from start to end, which are all in the current window """
+        width = self.width
+        for column in range(1, width):
+            # Every column is summed up by the builtins in one call instead of value by value
+            column_values = values[start * width + column:end * width:width]
+            total = sum(column_values)
+            if total != total:
+                # Leaves out the NaN of sensors that were not read
+                column_values = [value for value in column_values if value == value]
+                if not column_values:
+                    continue
+                total = sum(column_values)
+            index = column - 1
+            self.count[index] += len(column_values)
+            self.total[index] += total
+            self.squares[index] += sum(map(mul, column_values, column_values))
+            low = min(column_values)
+            if low < self.low[index]:
+                self.low[index] = low
+            high = max(column_values)
+            if high > self.high[index]:
+                self.high[index] = high
+
+    def _emit(self, out):
+        """ Appends the statistics of the current window to out """
+        out.append(self.key * self.window)
+        for count, total, squares, low, high in zip(self.count, self.total, self.squares, self.low, self.high):
+            if count:
+                mean = total / count
+                std = math.sqrt(max(squares / count - mean * mean, 0.0))
+                out.extend((mean, low, high, std, count))
+            else:
+                out.extend((nan, nan, nan, nan, 0))
+        self.windows += 1
+
+    def close(self):
+        """ Returns the aggregated row of the last, unfinished window. """
+        out = array("d")
+        if self.key is not None:
+            self._emit(out)
+            self._reset(None)
+        return out
+
+    def _keep(self, values, rows):
+        """ Copies the rows into the raw ring """
+        width = self.width
+        size = self.raw_size
+        if rows > size:
+            values = values[(rows - size) * width:]
+            rows = size
+        with self.lock:
+            first = self.raw_rows % size
+            part = min(rows, size - first)
+            self.raw[first * width:(first + part) * width] = array("d", values[:part * width])
+            if part < rows:
+                self.raw[:(rows - part) * width] = array("d", values[part * width:rows * width])
+            self.raw_rows += rows
+
+    def recent(self):
+        """ Returns the raw rows in the ring, oldest first. """
+        width = self.width
+        with self.lock:
+            count = min(self.raw_rows, self.raw_size)
+            first = (self.raw_rows - count) % self.raw_size if self.raw_size else 0
+            order = [(first + row) % self.raw_size for row in range(count)]
+            return [self.raw[row * width:(row + 1) * width].tolist() for row in order]
+
+    def stats(self):
+        return {"window": self.window,
+                "rows": self.rows,
+                "windows": self.windows,
+                "raw_size": self.raw_size,
+                "recent": self.recent() if self.raw_size else None}
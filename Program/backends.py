@@ -0,0 +1,29 @@
+""" Selects the module that provides the SenseHat class.
+
+The backend is chosen with the DATACOLLECTOR_BACKEND environment variable:
+
+    hardware   The Sense HAT on a Raspberry Pi (sense_hat), the default
+    emulator   The Sense HAT emulator (sense_emu)
+    fake       The in-process fake device (fakesense)
+    replay     A recorded data file played back (replay)
+"""
+from importlib import import_module
+import os
+
+backends = {"hardware": "sense_hat",
+            "emulator": "sense_emu",
+            "fake": "fakesense",
+            "replay": "replay"}
+
+def backend_name():
+    """ Returns the name of the selected backend. """
+    return os.environ.get("DATACOLLECTOR_BACKEND", "hardware")
+
+def load_backend(name=None):
+    """ Imports and returns the module of the backend. """
+    name = name or backend_name()
+    try:
+        module = backends[name]
+    except KeyError:
+        raise ValueError("Unknown backend: {} (choose from {})".format(name, ", ".join(backends)))
+    return import_module(module)
@@ -0,0 +1,147 @@
+""" Measures how fast the DataCollector can collect and write data.
+
+Runs the get_sense_data -> log_data -> writer pipeline against the fake
+device for a number of sensor combinations and target rates, and reports the
+achieved samples per second, the timing jitter, the CPU time per sample, the
+peak memory and the bytes written. The jitter is how late each sample started
+at a target rate, and how far each interval between samples was from the mean
+interval when collecting as fast as possible. The results are saved as JSON, and can be
+compared with an earlier result file to catch regressions:
+
+    python bench.py --output new.json --baseline old.json
+"""
+import os
+os.environ["DATACOLLECTOR_BACKEND"] = "fake"
+
+from datetime import datetime
+from multiprocessing import Pool
+from time import perf_counter, process_time
+import argparse
+import json
+import platform
+import resource
+import sys
+import tempfile
+
+# Sensor combinations from a single sensor up to all seven
+default_sensors = ["A", "AT", "ATP", "ATPH", "ATPHG", "ATPHGO", "ATPHGOM"]
+default_rates = [10, 100, 1000, 0] # Target rates in Hz, 0 collects as fast as possible
+
+def percentile(values, fraction):
+    """ Returns the value below which the given fraction of the sorted values lie. """
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def run_case(sensors, rate, duration, file_format, latency):
+    """ Collects data for the given time and returns the measurements. """
+    import fakesense
+    from DataCollector import DataCollector
+    from scheduler import Scheduler
+
+    fakesense.SenseHat.latency = latency
+    dataCollector = DataCollector(interactive=False)
+    for sensor in sensors:
+        dataCollector.sensors[sensor] = True
+    dataCollector.delay = 1.0 / rate if rate else 0
+    dataCollector.file_format = file_format
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        dataCollector.file_setup()
+        header_size = os.path.getsize(dataCollector.file_name)
+        writer = dataCollector.open_writer()
+        scheduler = Scheduler(dataCollector.delay, dataCollector.overrun_policy)
+        lateness = []
+        starts = [] # Start of every sample when free running, which has no schedule to be late for
+        start_time = datetime.now()
+        start_cpu = process_time()
+        start = perf_counter()
+        end = start + duration
+        while perf_counter() < end:
+            lateness.append(scheduler.wait())
+            if not rate:
+                starts.append(perf_counter())
+            dataCollector.log_data(writer, start_time)
+        writer.close()
+        elapsed = perf_counter() - start
+        cpu = process_time() - start_cpu
+        size = os.path.getsize(dataCollector.file_name) - header_size
+
+    samples = writer.written
+    if len(starts) > 1:
+        intervals = [after - before for before, after in zip(starts, starts[1:])]
+        mean = sum(intervals) / len(intervals)
+        lateness = [abs(interval - mean) for interval in intervals]
+    lateness.sort()
+    return {"sensors": sensors,
+            "rate": rate,
+            "format": file_format,
+            "latency": latency,
+            "samples": samples,
+            "samples_per_s": samples / elapsed,
+            "jitter_p50": percentile(lateness, 0.5),
+            "jitter_p90": percentile(lateness, 0.9),
+            "jitter_p99": percentile(lateness, 0.99),
+            "jitter_max": lateness[-1] if lateness else 0.0,
+            "overruns": scheduler.overruns,
+            "cpu_per_sample": cpu / samples if samples else 0.0,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "bytes": size,
+            "bytes_per_sample": size / samples if samples else 0.0}
+
+def compare(results, baseline, tolerance):
+    """ Prints the cases that got slower than the baseline and returns how many there are. """
+    key = lambda result: (result["sensors"], result["rate"], result["format"], result["latency"])
+    old = {key(result): result for result in baseline["results"]}
+    regressions = 0
+    for result in results:
+        before = old.get(key(result))
+        if before is None or not before["samples_per_s"]:
+            continue
+        change = result["samples_per_s"] / before["samples_per_s"] - 1
+        if change < -tolerance:
+            regressions += 1
+            print("Regression {sensors} @ {rate:g} Hz ({format}): {change:+.1%} samples/s".format(change=change, **result))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", nargs="+", default=default_sensors, help="sensor combinations to run")
+    parser.add_argument("--rates", nargs="+", type=float, default=default_rates, help="target rates in Hz, 0 is as fast as possible")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per case")
+    parser.add_argument("--format", dest="formats", nargs="+", default=["csv"], help="file formats to run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per read of the fake device")
+    parser.add_argument("--output", default="bench.json", help="file the results are written to")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed drop in samples/s before it is a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    # Every case runs in a fresh process so the peak memory is its own
+    with Pool(1, maxtasksperchild=1) as pool:
+        for file_format in args.formats:
+            for sensors in args.sensors:
+                for rate in args.rates:
+                    result = pool.apply(run_case, (sensors, rate, args.duration, file_format, args.latency))
+                    results.append(result)
+                    print("{sensors:>7} {rate:>6g} Hz {format:>6}: {samples_per_s:9.0f} samples/s  "
+                          "jitter p99 {jitter_p99:.6f} s  {cpu_per_sample:.6f} s cpu/sample  "
+                          "{peak_rss_kb} kB  {bytes_per_sample:.0f} B/sample".format(**result))
+
+    report = {"date": datetime.now().isoformat(),
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "duration": args.duration,
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
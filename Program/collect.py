@@ -0,0 +1,173 @@
+""" Collects data without the LED menu.
+
+Starts collecting as soon as it is run, which makes it suited for running the
+DataCollector from scripts or as a systemd service, e.g.
+
+    python collect.py ATH --delay 0.1 --duration 3600 --output /home/pi/data
+
+The collection stops after --count collections or --duration seconds, or when
+the process gets SIGINT or SIGTERM. Without either limit it runs until it is
+stopped, or until the end of the recording with --replay. The data file is
+named after the sensors and the start time as usual. With --compress,
+--segment-size or --segment-time the data is split into segment files with an
+index instead, see segments.py. With --window only the statistics of every
+column per window are written, see aggregate.py, and with --trigger only the
+collections around events, see trigger.py.
+
+A recorded data file can be collected again as if it came from the sensors,
+here ten times faster than it was recorded, see replay.py:
+
+    python collect.py ATH --delay 0 --replay "ATH-2018-06-01 12:00:00.csv" --speed 10
+"""
+import argparse
+import os
+import signal
+import sys
+
+from schema import sensor_letters
+
+def parse_rate(text):
+    """ Parses a sensor rate given as LETTER=HZ, e.g. T=1. """
+    sensor, _, rate = text.partition("=")
+    if sensor not in sensor_letters or not rate:
+        raise argparse.ArgumentTypeError("expected LETTER=HZ with a letter from {}, got {}".format(sensor_letters, text))
+    return sensor, float(rate)
+
+def parse_bands(text):
+    """ Parses frequency bands given as LOW-HIGH in Hz separated by commas, e.g. 1-10,10-50. """
+    bands = []
+    for band in text.split(","):
+        low, _, high = band.partition("-")
+        try:
+            low, high = float(low), float(high)
+        except ValueError:
+            raise argparse.ArgumentTypeError("expected bands as LOW-HIGH,LOW-HIGH in Hz, got {}".format(text))
+        if not 0 <= low < high:
+            raise argparse.ArgumentTypeError("a band must go from a lower to a higher frequency, got {}".format(band))
+        bands.append((low, high))
+    return bands
+
+def parse_sensors(text):
+    text = text.upper()
+    if not text or any(sensor not in sensor_letters for sensor in text):
+        raise argparse.ArgumentTypeError("sensors must be letters from {}, got {}".format(sensor_letters, text))
+    return text
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sensors", type=parse_sensors,
+                        help="sensors to read: A(ccelerometer) T(emperature) P(ressure) H(umidity) "
+                             "G(yroscope) O(rientation) M(agnetometer)")
+    parser.add_argument("-d", "--delay", type=float, default=0.3, help="seconds between collections (default 0.3)")
+    parser.add_argument("-n", "--count", type=int, default=0, help="number of collections, 0 has no limit")
+    parser.add_argument("-t", "--duration", type=float, default=0, help="seconds to collect, 0 has no limit")
+    parser.add_argument("-o", "--output", default="", help="directory the data file is written to")
+    parser.add_argument("-f", "--format", default="csv", choices=["csv", "binary"], help="format of the data file")
+    parser.add_argument("-r", "--rate", type=parse_rate, action="append", default=[],
+                        help="read a sensor at its own rate, e.g. -r T=1 -r H=0.5")
+    parser.add_argument("-z", "--compress", choices=["gzip", "lzma"], help="compress the data into segment files")
+    parser.add_argument("--segment-size", type=float, default=0, help="start a new segment file after this many MB")
+    parser.add_argument("-w", "--window", type=float, default=0,
+                        help="write the mean, min, max, std and count of every column per window of this many seconds")
+    parser.add_argument("--raw-ring", type=int, default=0, help="raw collections kept in memory while aggregating, listed in the live stats and the summary")
+    parser.add_argument("--trigger", type=float, default=0,
+                        help="only write the collections around the times the acceleration reaches this many g")
+    parser.add_argument("--pre", type=float, default=1.0, help="seconds written before a trigger")
+    parser.add_argument("--post", type=float, default=1.0, help="seconds written after a trigger")
+    parser.add_argument("--spectrum", type=float, default=0,
+                        help="write the band energies and peak frequencies of A and G per window of this many seconds")
+    parser.add_argument("--bands", type=parse_bands, default=None,
+                        help="frequency bands of the spectrum in Hz (default 1-10,10-50,50-100,100-250,250-500)")
+    parser.add_argument("--levels", action="store_true", help="show the vibration levels on the LED matrix (needs --display)")
+    parser.add_argument("--segment-time", type=float, default=0, help="start a new segment file after this many seconds")
+    parser.add_argument("--server", metavar="HOST:PORT", help="also send the data to the collector at this address")
+    parser.add_argument("--unit", help="name of this unit on the collector (default the host name)")
+    parser.add_argument("--backlog", type=float, default=64,
+                        help="MB of data kept for the collector while it can not be reached")
+    parser.add_argument("--policy", default="skip", choices=["skip", "catchup"], help="what to do when a collection is late")
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="seconds between writes to the data file")
+    parser.add_argument("--fsync", default="close", choices=["never", "flush", "close"], help="when the data file is synced")
+    parser.add_argument("--buffer-size", type=int, default=1000, help="collections that can wait to be written")
+    parser.add_argument("--stats-interval", type=float, default=1.0,
+                        help="seconds between updates of the live stats file next to the data file, 0 turns it off")
+    parser.add_argument("--stats-socket", help="Unix socket that serves the live stats as JSON")
+    parser.add_argument("--engine", default="threads", choices=["threads", "asyncio", "processes"],
+                        help="how the collection is run, processes writes the data from a process of its own")
+    parser.add_argument("--backend", choices=["hardware", "emulator", "fake", "replay"], help="sensor backend (default hardware)")
+    parser.add_argument("--replay", metavar="FILE", help="replay a recorded CSV data file instead of reading the sensors")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 is the recorded rate and 0 as fast as possible")
+    parser.add_argument("--loop", action="store_true", help="start the replay again at the end of the recording")
+    parser.add_argument("--display", action="store_true", help="show the progress on the LED matrix")
+    parser.add_argument("--display-rate", type=float, default=20, help="most frames per second drawn on the LED matrix")
+    args = parser.parse_args(argv)
+    if bool(args.window) + bool(args.trigger) + bool(args.spectrum) > 1:
+        parser.error("only one of --window, --trigger and --spectrum can be used")
+    if args.trigger and "A" not in args.sensors:
+        parser.error("--trigger needs the accelerometer (A)")
+    if args.spectrum and "A" not in args.sensors and "G" not in args.sensors:
+        parser.error("--spectrum needs the accelerometer (A) or the gyroscope (G)")
+    if args.levels and not (args.spectrum and args.display):
+        parser.error("--levels needs --spectrum and --display")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.backend:
+        os.environ["DATACOLLECTOR_BACKEND"] = args.backend
+    if args.replay:
+        os.environ["DATACOLLECTOR_BACKEND"] = "replay"
+        os.environ["REPLAY_FILE"] = args.replay
+        os.environ["REPLAY_SPEED"] = str(args.speed)
+        os.environ["REPLAY_LOOP"] = "1" if args.loop else "0"
+    # Imported after the arguments are parsed so --help and argument errors do not load the sensor libraries
+    from DataCollector import DataCollector
+
+    dataCollector = DataCollector(interactive=False)
+    for sensor in args.sensors:
+        dataCollector.sensors[sensor] = True
+    dataCollector.delay = args.delay
+    dataCollector.write_freq = args.count
+    dataCollector.duration = args.duration
+    dataCollector.output_dir = args.output
+    dataCollector.file_format = args.format
+    dataCollector.rates = dict(args.rate)
+    dataCollector.compression = args.compress
+    dataCollector.segment_size = int(args.segment_size * 1e6)
+    dataCollector.segment_time = args.segment_time
+    dataCollector.window = args.window
+    dataCollector.raw_ring = args.raw_ring
+    dataCollector.trigger = args.trigger
+    dataCollector.trigger_pre = args.pre
+    dataCollector.trigger_post = args.post
+    dataCollector.spectrum = args.spectrum
+    if args.bands:
+        dataCollector.spectrum_bands = args.bands
+    dataCollector.spectrum_levels = args.levels
+    dataCollector.server = args.server
+    if args.unit:
+        dataCollector.unit = args.unit
+    dataCollector.network_backlog = args.backlog * 1e6
+    dataCollector.overrun_policy = args.policy
+    dataCollector.flush_interval = args.flush_interval
+    dataCollector.fsync = args.fsync
+    dataCollector.buffer_size = args.buffer_size
+    dataCollector.display = args.display
+    dataCollector.display_rate = args.display_rate
+    dataCollector.engine = args.engine
+    dataCollector.stats_interval = args.stats_interval
+    dataCollector.stats_socket = args.stats_socket
+
+    # Stops the collection cleanly so the data file and the summary are complete
+    stop = lambda signum, frame: dataCollector.stop()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    dataCollector.file_setup()
+    print(dataCollector.file_name, flush=True)
+    dataCollector.collect_data()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+""" Draws on the LED matrix without holding up the collection.
+
+During a collection the progress animation, the countdown and the messages are
+not drawn by the thread that collects, but handed to a Renderer thread. Asking
+for a frame only stores it, so it never waits for the LED matrix. The renderer
+draws the newest frame it was given, skips frames that are the same as the one
+on the matrix, and draws at most max_rate frames per second. Frames that are
+asked for while a message scrolls are replaced by newer ones, so only the
+latest is drawn after the message.
+"""
+from threading import Thread, Lock, Event
+from time import monotonic, perf_counter
+
+white = (255, 255, 255)
+black = (0, 0, 0)
+
+class Renderer(Thread):
+    """ Draws the newest frame asked for on the LED matrix of sense. """
+
+    def __init__(self, sense, max_rate=20, stats=None):
+        super().__init__(daemon=True)
+        self.sense = sense
+        self.interval = 1.0 / max_rate if max_rate else 0 # Shortest time between two frames
+        self.latency = stats # Stats the drawing time of every frame is recorded in
+        self.lock = Lock()
+        self.ready = Event() # Set when there is a new frame to draw
+        self.stopped = Event()
+        self.pending = None # (key, draw, args) of the newest frame that is not drawn yet
+        self.shown = None # Key of the frame on the matrix
+        self.requested = 0 # Frames asked for
+        self.drawn = 0 # Frames written to the matrix
+
+    def pixels(self, pixel_list):
+        """ Shows a list of 64 pixels. """
+        self._request(tuple(pixel_list), self.sense.set_pixels, pixel_list)
+
+    def dot(self, x, y, colour=white):
+        """ Shows a single pixel on an empty matrix. """
+        pixel_list = [black] * 64
+        pixel_list[y * 8 + x] = colour
+        self.pixels(pixel_list)
+
+    def bars(self, heights, colour=white):
+        """ Shows a column of height pixels, from the bottom, for each of up to 8 heights. """
+        pixel_list = [black] * 64
+        for x, height in enumerate(heights[:8]):
+            for y in range(8 - min(max(height, 0), 8), 8):
+                pixel_list[y * 8 + x] = colour
+        self.pixels(pixel_list)
+
+    def letter(self, letter, colour=white):
+        self._request(("letter", letter, colour), self.sense.show_letter, letter, colour)
+
+    def message(self, text, scroll_speed=0.1, colour=white):
+        """ Scrolls a message. It blocks the renderer, not the caller. """
+        self._request(("message", text, colour), self.sense.show_message, text, scroll_speed, colour)
+
+    def _request(self, key, draw, *args):
+        with self.lock:
+            self.pending = (key, draw, args)
+            self.requested += 1
+        self.ready.set()
+
+    def run(self):
+        last = 0.0
+        while not self.stopped.is_set():
+            self.ready.wait()
+            # Keeps to the refresh cap. Frames asked for in the meantime replace the pending one
+            wait = last + self.interval - monotonic()
+            if wait > 0 and self.stopped.wait(wait):
+                break
+            with self.lock:
+                self.ready.clear()
+                pending, self.pending = self.pending, None
+            if pending is None or self.stopped.is_set():
+                continue
+            key, draw, args = pending
+            if key == self.shown:
+                continue
+            start = perf_counter()
+            draw(*args)
+            if self.latency is not None:
+                self.latency.record("display", perf_counter() - start)
+            self.shown = key
+            self.drawn += 1
+            last = monotonic()
+
+    def stop(self):
+        """ Stops drawing. Waits for the frame that is being drawn, pending frames are dropped. """
+        self.stopped.set()
+        self.ready.set()
+        self.join()
+
+    def stats(self):
+        return {"requested": self.requested,
+                "drawn": self.drawn,
+                "max_rate": 1.0 / self.interval if self.interval else 0}
@@ -0,0 +1,135 @@
+""" Runs a collection as asyncio tasks in a single thread.
+
+The sampling, the writing, the display and the joystick are cooperative tasks
+instead of threads that poll each other. Sampling waits for its deadlines with
+asyncio.sleep, the writer task hands the formatting and writing of each batch
+to the default executor so it never holds up a sample, the frames of the
+display are handed to the renderer of the collector (see display.py) and the
+joystick is polled without a blocking thread. Stopping cancels the tasks at
+once, after which the writer writes what is left.
+"""
+from time import monotonic, sleep
+import asyncio
+
+class AsyncEngine:
+    """ Collects data for a DataCollector with asyncio. """
+
+    spin = 0.001 # The last part of a wait is slept without asyncio, whose timers have millisecond resolution
+    display_interval = 0.05 # Shortest time between display updates
+    joystick_interval = 0.05 # Time between polls of the joystick
+
+    def __init__(self, collector, writer, start_time, scheduler):
+        self.collector = collector
+        self.writer = writer # A StreamWriter whose thread is not started
+        self.start_time = start_time
+        self.scheduler = scheduler
+        self.loop = None
+        self.stopped = None # Set to stop the collection
+        self.rows_ready = None # Set when the writer has rows to write
+        self.finishing = False
+
+    def stop(self):
+        """ Stops the collection. Can be called from other threads and signal handlers. """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.rows_ready = asyncio.Event()
+        sample = asyncio.create_task(self._sample())
+        stop = asyncio.create_task(self.stopped.wait())
+        write = asyncio.create_task(self._write())
+        others = []
+        if self.collector.display:
+            others.append(asyncio.create_task(self._display()))
+            if not self.collector.write_freq:
+                # Runs until the joystick is activated, as in the threaded collection
+                others.append(asyncio.create_task(self._joystick()))
+        try:
+            await asyncio.wait([sample, stop], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in [sample, stop] + others:
+                task.cancel()
+            await asyncio.gather(sample, stop, *others, return_exceptions=True)
+            # The writer finishes its current batch and writes the rest when the writer is closed
+            self.finishing = True
+            self.rows_ready.set()
+            await write
+        if not sample.cancelled() and sample.exception() is not None:
+            raise sample.exception()
+        if self.writer.error is not None:
+            raise self.writer.error
+
+    async def _sample(self):
+        collector = self.collector
+        writer = self.writer
+        buffer = writer.buffer
+        scheduler = self.scheduler
+        end = monotonic() + collector.duration if collector.duration else None
+        while not collector.stop_event.is_set():
+            delay = scheduler.advance()
+            await asyncio.sleep(delay - self.spin if delay > self.spin else 0)
+            remaining = scheduler.deadline - monotonic()
+            if remaining > 0:
+                sleep(remaining)
+            scheduler.tick()
+            # A failed writer makes no more room, so the row is dropped by the writer instead
+            if buffer.full() and writer.error is None:
+                await self._wait_for_space()
+            collector.log_data(writer, self.start_time)
+            if len(buffer) >= buffer.half:
+                self.rows_ready.set()
+            if collector.write_freq and writer.rows >= collector.write_freq:
+                break
+            if end is not None and monotonic() >= end:
+                break
+
+    async def _wait_for_space(self):
+        """ Waits for the writer to make room in a full buffer without blocking the loop """
+        self.writer.backpressure += 1
+        start = monotonic()
+        self.rows_ready.set()
+        while self.writer.buffer.full() and self.writer.error is None:
+            await asyncio.sleep(self.spin)
+        self.writer.blocked_time += monotonic() - start
+
+    async def _write(self):
+        try:
+            await self._write_rows()
+        except Exception as error:
+            # Handled as a failed writer thread, see StreamWriter.run
+            self.writer.error = error
+            self.writer.buffer.release(len(self.writer.buffer))
+
+    async def _write_rows(self):
+        writer = self.writer
+        last_flush = monotonic()
+        while not self.finishing:
+            timeout = max(last_flush + writer.flush_interval - monotonic(), 0)
+            try:
+                await asyncio.wait_for(self.rows_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.rows_ready.clear()
+            await self.loop.run_in_executor(None, writer.drain)
+            if monotonic() - last_flush >= writer.flush_interval:
+                await self.loop.run_in_executor(None, writer.flush)
+                last_flush = monotonic()
+
+    async def _display(self):
+        collector = self.collector
+        if not collector.write_freq:
+            collector._show_navigation()
+            return
+        pn = 0
+        while True:
+            pn = collector._show_progress(self.writer.rows, pn)
+            await asyncio.sleep(max(collector.delay, self.display_interval))
+
+    async def _joystick(self):
+        stick = self.collector.stick
+        stick.get_events() # Throws away the events from before the collection
+        while not stick.get_events():
+            await asyncio.sleep(self.joystick_interval)
+        self.stopped.set()
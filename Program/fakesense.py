@@ -0,0 +1,186 @@
+""" An in-process stand-in for the Sense HAT.
+
+Produces synthetic sensor signals so the collection and writing of data can be
+run and measured on any computer. The signals are smooth functions of a virtual
+clock plus seeded noise. Every sensor has its own clock, which advances by a
+fixed step per read, and its own noise, so the same reads give the same values
+in every run however fast they are made. Every read can be given a latency to
+mimic the time the real sensors take, which only delays it. The joystick is
+driven by pushing events onto it, and the LED matrix is kept in memory.
+
+The defaults can be set with environment variables:
+
+    FAKESENSE_LATENCY   Seconds per sensor read (default 0)
+    FAKESENSE_STEP      Seconds the clock of a sensor advances per read (default 0.001)
+    FAKESENSE_SEED      Seed of the noise (default 0)
+    FAKESENSE_JOYSTICK  Comma separated directions that are pressed in turn,
+                        e.g. "right,up,middle"
+"""
+from collections import namedtuple
+from queue import Queue, Empty
+from random import Random
+from time import sleep, time
+import math
+import os
+
+DIRECTION_UP = "up"
+DIRECTION_DOWN = "down"
+DIRECTION_LEFT = "left"
+DIRECTION_RIGHT = "right"
+DIRECTION_MIDDLE = "middle"
+
+ACTION_PRESSED = "pressed"
+ACTION_RELEASED = "released"
+ACTION_HELD = "held"
+
+InputEvent = namedtuple("InputEvent", ("timestamp", "direction", "action"))
+
+class SenseStick:
+    """ Joystick that returns the events pushed onto it. """
+
+    def __init__(self, directions=()):
+        self.events = Queue()
+        for direction in directions:
+            self.push(direction)
+
+    def push(self, direction, action=ACTION_PRESSED):
+        """ Simulates a joystick event. """
+        self.events.put(InputEvent(time(), direction, action))
+
+    def wait_for_event(self, emptybuffer=False):
+        # Pushed events are a script, so emptybuffer does not throw them away
+        return self.events.get()
+
+    def get_events(self):
+        events = []
+        try:
+            while True:
+                events.append(self.events.get_nowait())
+        except Empty:
+            return events
+
+class FakeIMU:
+    """ Mimics the RTIMU object that the sense_hat module reads the IMU through. """
+
+    def __init__(self, sense):
+        self.sense = sense
+        self.reads = 0 # Number of IMU reads, to count the reads per collection
+        self.time = 0.0 # Clock of the last read
+
+    def IMURead(self):
+        self.reads += 1
+        self.time = self.sense._wait("imu")
+        return True
+
+    def getIMUData(self):
+        t = self.time
+        noise = self.sense._random("imu").gauss
+        # Gravity along z with vibration at 12 Hz and 50 Hz
+        vibration = 0.05 * math.sin(2 * math.pi * 12 * t) + 0.02 * math.sin(2 * math.pi * 50 * t)
+        accel = (vibration + noise(0, 0.002), 0.5 * vibration + noise(0, 0.002), 1.0 + noise(0, 0.002))
+        gyro = (0.1 * math.sin(2 * math.pi * 0.5 * t), 0.1 * math.cos(2 * math.pi * 0.5 * t), noise(0, 0.01))
+        pose = (0.1 * math.sin(2 * math.pi * 0.05 * t), 0.1 * math.cos(2 * math.pi * 0.05 * t), 0.01 * t)
+        compass = (20 + noise(0, 0.5), -5 + noise(0, 0.5), 40 + noise(0, 0.5))
+        return {"accelValid": True, "accel": accel,
+                "gyroValid": True, "gyro": gyro,
+                "fusionPoseValid": True, "fusionPose": pose,
+                "compassValid": True, "compass": compass}
+
+class SenseHat:
+    """ Fake Sense HAT with the same methods as sense_hat.SenseHat. """
+
+    latency = float(os.environ.get("FAKESENSE_LATENCY", 0)) # Seconds per read, or a dict per sensor
+    step = float(os.environ.get("FAKESENSE_STEP", 0.001))
+    seed = int(os.environ.get("FAKESENSE_SEED", 0))
+    joystick = [direction for direction in os.environ.get("FAKESENSE_JOYSTICK", "").split(",") if direction]
+
+    def __init__(self):
+        self.randoms = {} # Noise of every sensor
+        self._imu = FakeIMU(self)
+        self.stick = SenseStick(self.joystick)
+        self.pixels = [[0, 0, 0]] * 64
+        self.frames = 0 # Number of writes to the LED matrix
+        self.rotation = 0
+        self.low_light = False
+        self.reads = {} # Number of reads per sensor
+        self._last = {"accel": None, "gyro": None, "fusionPose": None, "compass": None}
+
+    def _wait(self, sensor):
+        """ Counts a read of the sensor, waits for its latency and returns the clock of the sensor at the read. """
+        reads = self.reads[sensor] = self.reads.get(sensor, 0) + 1
+        latency = self.latency.get(sensor, 0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            sleep(latency)
+        return (reads - 1) * self.step
+
+    def _random(self, sensor):
+        """ Returns the noise of the sensor, seeded by seed and the sensor """
+        if sensor not in self.randoms:
+            self.randoms[sensor] = Random("{}:{}".format(self.seed, sensor))
+        return self.randoms[sensor]
+
+    def _read_imu(self):
+        return self._imu.IMURead()
+
+    def _get_raw_data(self, is_valid_key, data_key):
+        if self._read_imu():
+            data = self._imu.getIMUData()
+            if data[is_valid_key]:
+                raw = data[data_key]
+                self._last[data_key] = {"x": raw[0], "y": raw[1], "z": raw[2]}
+        return dict(self._last[data_key])
+
+    # Sensors
+
+    def get_accelerometer_raw(self):
+        return self._get_raw_data("accelValid", "accel")
+
+    def get_gyroscope_raw(self):
+        return self._get_raw_data("gyroValid", "gyro")
+
+    def get_compass_raw(self):
+        return self._get_raw_data("compassValid", "compass")
+
+    def get_orientation(self):
+        raw = self._get_raw_data("fusionPoseValid", "fusionPose")
+        return {"roll": math.degrees(raw["x"]) % 360,
+                "pitch": math.degrees(raw["y"]) % 360,
+                "yaw": math.degrees(raw["z"]) % 360}
+
+    def get_temperature(self):
+        t = self._wait("temperature")
+        return 25 + 2 * math.sin(2 * math.pi * t / 600) + self._random("temperature").gauss(0, 0.05)
+
+    def get_pressure(self):
+        t = self._wait("pressure")
+        return 1013.25 + 0.5 * math.sin(2 * math.pi * t / 3600) + self._random("pressure").gauss(0, 0.02)
+
+    def get_humidity(self):
+        t = self._wait("humidity")
+        return 40 + 5 * math.sin(2 * math.pi * t / 1800) + self._random("humidity").gauss(0, 0.1)
+
+    # LED matrix
+
+    def set_pixel(self, x, y, *pixel):
+        if len(pixel) == 1:
+            pixel = pixel[0]
+        self.pixels[y * 8 + x] = list(pixel)
+        self.frames += 1
+
+    def set_pixels(self, pixel_list):
+        self.pixels = [list(pixel) for pixel in pixel_list]
+        self.frames += 1
+
+    def get_pixels(self):
+        return [list(pixel) for pixel in self.pixels]
+
+    def clear(self, *colour):
+        if len(colour) == 1:
+            colour = colour[0]
+        self.set_pixels([colour or (0, 0, 0)] * 64)
+
+    def show_letter(self, s, text_colour=(255, 255, 255), back_colour=(0, 0, 0)):
+        self.clear(back_colour)
+
+    def show_message(self, text_string, scroll_speed=0.1, text_colour=(255, 255, 255), back_colour=(0, 0, 0)):
+        self.clear(back_colour)
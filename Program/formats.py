@@ -0,0 +1,121 @@
+""" Output formats for the data files.
+
+The CSV format is the original text layout. The binary format stores every
+collection as a fixed width record of little endian float64 values, one per
+column, after a JSON header that describes the columns. Sensors that were not
+read in a collection are stored as NaN.
+
+Binary files can be converted back to the CSV layout with
+
+    python formats.py FILE.dcb [FILE.dcb ...]
+"""
+from array import array
+import json
+import os
+import struct
+import sys
+
+from schema import dtype
+
+MAGIC = b"DCBIN\x00\x01\x00" # File signature and format version
+_length = struct.Struct("<I")
+
+class CsvFormat:
+    """ Comma separated text, one line per collection. """
+    name = "csv"
+    extension = ".csv"
+    binary = False
+
+    def header(self, columns, info=None):
+        return " , ".join(str(value) for value in columns) + "\n"
+
+    def encode(self, values, width):
+        """ Formats flat float values as lines of width columns. NaN is left empty. """
+        text = ["" if value != value else str(value) for value in values]
+        return "".join(",".join(text[start:start + width]) + "\n" for start in range(0, len(text), width))
+
+class BinaryFormat:
+    """ Fixed width float64 records after a JSON header. """
+    name = "binary"
+    extension = ".dcb"
+    binary = True
+
+    def header(self, columns, info=None):
+        header = dict(info or {})
+        header.update({"columns": list(columns),
+                       "dtype": dtype,
+                       "record_size": 8 * len(columns)})
+        text = json.dumps(header).encode()
+        # Pads the header so the records start at a multiple of 8 bytes
+        size = len(MAGIC) + _length.size + len(text)
+        text += b" " * (-size % 8)
+        return MAGIC + _length.pack(len(text)) + text
+
+    def encode(self, values, width):
+        """ Returns flat float values as little endian bytes. """
+        if sys.byteorder != "little":
+            values = array("d", values)
+            values.byteswap()
+        return memoryview(values).cast("B")
+
+formats = {CsvFormat.name: CsvFormat, BinaryFormat.name: BinaryFormat}
+
+def get_format(name):
+    """ Returns the output format with the given name. """
+    try:
+        return formats[name]()
+    except KeyError:
+        raise ValueError("Unknown file format: {}".format(name))
+
+def read_header(source):
+    """ Returns the header of a binary data file and the offset of the first record.
+
+    source is a file name, or a binary file open at its start, e.g. a
+    decompressing one, which is left at the first record. """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, "rb") as f:
+            return read_header(f)
+    if source.read(len(MAGIC)) != MAGIC:
+        raise ValueError("{} is not a DataCollector binary file".format(getattr(source, "name", "The file")))
+    length, = _length.unpack(source.read(_length.size))
+    header = json.loads(source.read(length).decode())
+    return header, len(MAGIC) + _length.size + length
+
+def read_records(f, record_size, chunk=4096):
+    """ Yields the whole records from the position of the open binary file f on, at most chunk at a time. """
+    while True:
+        data = f.read(chunk * record_size)
+        # Ignores a partly written record at the end of the file
+        data = data[:len(data) - len(data) % record_size]
+        if not data:
+            break
+        yield data
+
+def load(file_name):
+    """ Memory maps a binary data file as a NumPy record array with one field per column. """
+    import numpy as np
+    header, offset = read_header(file_name)
+    dtype = np.dtype([(column, header["dtype"]) for column in header["columns"]])
+    count = (os.path.getsize(file_name) - offset) // dtype.itemsize
+    return np.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+def to_csv(file_name, csv_name=None, chunk=4096):
+    """ Converts a binary data file to the CSV layout and returns the name of the CSV file. """
+    header, offset = read_header(file_name)
+    columns = header["columns"]
+    if csv_name is None:
+        csv_name = os.path.splitext(file_name)[0] + CsvFormat.extension
+    csv = CsvFormat()
+    with open(file_name, "rb") as f, open(csv_name, "w") as out:
+        out.write(csv.header(columns))
+        f.seek(offset)
+        for data in read_records(f, header["record_size"], chunk):
+            values = array("d", data)
+            if sys.byteorder != "little":
+                values.byteswap()
+            out.write(csv.encode(values, len(columns)))
+    return csv_name
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        print(to_csv(name))
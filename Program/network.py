@@ -0,0 +1,507 @@
+""" Streams the data of many units to a collector over TCP.
+
+With a server set, the writer sends every encoded batch to a NetworkOutput,
+which writes it to the local output as usual and also sends it to a collector.
+The collector accepts any number of units at once, and stores the sessions of
+each unit as segment files with an index, see segments.py:
+
+    DATA/unit1/AT-2018-06-01 12:00:00.index.json
+    DATA/unit1/AT-2018-06-01 12:00:00.0001.csv.gz
+
+The connection carries frames of a type byte and a payload length. A unit
+starts with a HELLO frame holding its name, its session and the format,
+columns and info of the data file, and then sends numbered DATA frames with the
+encoded rows of a batch. The collector acknowledges every batch once it is
+written, and answers HELLO with the last batch it has of the session. Batches
+stay in a backlog on the unit until they are acknowledged, so while the link
+is down they are kept and sent again after reconnecting, and the collector
+skips the ones it already has. The backlog is limited in bytes, and the oldest
+batches are dropped when it is full. An END frame closes the session.
+
+The collector runs as a process of its own:
+
+    python network.py serve --port 5050 --output DATA --compress gzip
+
+and its throughput with a number of simulated units is measured over localhost
+with
+
+    python network.py bench --units 1 4 16
+"""
+from collections import OrderedDict, deque
+from threading import Thread, Condition, Event
+from time import perf_counter
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+
+from formats import get_format
+from segments import SegmentedOutput
+
+HELLO = 1 # JSON with the unit, session, format, columns and info
+DATA = 2 # Sequence number, first and last time and rows of a batch, followed by the encoded rows
+ACK = 3 # Last sequence number the collector has written
+END = 4 # Sequence number of the end of the session
+
+_frame = struct.Struct("<BI")
+_batch = struct.Struct("<QddI")
+_ack = struct.Struct("<Q")
+
+default_port = 5050
+
+def parse_address(text):
+    """ Returns (host, port) for HOST:PORT, HOST or :PORT. """
+    host, _, port = text.rpartition(":") if ":" in text else (text, "", "")
+    return host or "localhost", int(port) if port else default_port
+
+def check_name(name):
+    """ Returns a unit or session name from the network if it can be used as a file name, else raises ValueError. """
+    if not isinstance(name, str) or name in ("", ".", "..") or name != os.path.basename(name) or "\0" in name:
+        raise ValueError("Invalid name: {!r}".format(name))
+    return name
+
+def frame(kind, payload=b""):
+    return _frame.pack(kind, len(payload)) + payload
+
+def _recv_exact(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The connection was closed")
+        data += chunk
+    return bytes(data)
+
+class NetworkOutput:
+    """ Writes to a local output and sends the same data to a collector. """
+
+    retry = 1.0 # Seconds between attempts to connect
+    close_timeout = 10.0 # Seconds close waits for the collector to acknowledge the backlog
+
+    def __init__(self, address, unit, session, file_format, columns, info=None, local=None, backlog=64e6):
+        self.address = address # (host, port) of the collector
+        self.hello = {"unit": unit,
+                      "session": session,
+                      "format": file_format.name,
+                      "columns": list(columns),
+                      "info": dict(info or {})}
+        self.local = local # The output the data is written to on the unit, or None
+        self.backlog = backlog # Bytes of batches kept until they are acknowledged
+        self.condition = Condition()
+        self.pending = deque() # (sequence, rows, frame) of the batches that are not acknowledged
+        self.pending_bytes = 0
+        self.sequence = 0 # Number of the last batch
+        self.sent = 0 # Number of the last batch sent on the current connection
+        self.acknowledged = 0 # Number of the last batch the collector has
+        self.connection = None
+        self.lost = False # Set when the current connection fails
+        self.closing = False
+        self.stopped = Event()
+        self.thread = None # Started by the first write, so it runs in the writer process
+        self.rows = 0 # Rows sent to the collector
+        self.bytes = 0 # Bytes of the frames sent
+        self.dropped = 0 # Rows dropped from a full backlog or left when closing
+        self.connects = 0
+        self.disconnects = 0
+
+    def write(self, data, first_time, last_time, rows):
+        if self.local is not None:
+            self.local.write(data, first_time, last_time, rows)
+        if isinstance(data, str):
+            data = data.encode()
+        with self.condition:
+            self.sequence += 1
+            batch = frame(DATA, _batch.pack(self.sequence, first_time, last_time, rows) + bytes(data))
+            self.pending.append((self.sequence, rows, batch))
+            self.pending_bytes += len(batch)
+            while self.pending_bytes > self.backlog and len(self.pending) > 1:
+                _, old_rows, old = self.pending.popleft()
+                self.pending_bytes -= len(old)
+                self.dropped += old_rows
+            self.condition.notify_all()
+        if self.thread is None:
+            self.thread = Thread(target=self._run, name="DataCollector network", daemon=True)
+            self.thread.start()
+
+    def flush(self, sync=False):
+        if self.local is not None:
+            self.local.flush(sync)
+
+    def close(self, sync=False):
+        """ Closes the local output and waits for the collector to acknowledge the backlog and the end. """
+        if self.local is not None:
+            self.local.close(sync)
+        if self.thread is None:
+            return
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join(self.close_timeout)
+        if self.thread.is_alive():
+            # The collector can not be reached, the batches that are left are lost
+            self.stopped.set()
+            with self.condition:
+                self.condition.notify_all()
+                if self.connection is not None:
+                    self.connection.close()
+            self.thread.join()
+        self.dropped += sum(rows for _, rows, _ in self.pending)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                connection = socket.create_connection(self.address, timeout=self.retry)
+            except OSError:
+                self.stopped.wait(self.retry)
+                continue
+            self.connects += 1
+            try:
+                if self._send(connection):
+                    return
+            except OSError:
+                pass
+            finally:
+                with self.condition:
+                    self.connection = None
+                connection.close()
+            self.disconnects += 1
+            self.stopped.wait(self.retry)
+
+    def _send(self, connection):
+        """ Sends the backlog and new batches until the connection fails. Returns True when the session ended. """
+        connection.settimeout(None)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.sendall(frame(HELLO, json.dumps(self.hello).encode()))
+        # The collector answers with the last batch it has, so batches it has written are not sent again
+        kind, payload = self._read_frame(connection)
+        self._acknowledge(_ack.unpack(payload)[0])
+        with self.condition:
+            self.connection = connection
+            self.lost = False
+            self.sent = self.acknowledged
+        reader = Thread(target=self._read, args=(connection,), daemon=True)
+        reader.start()
+        end = None
+        while True:
+            with self.condition:
+                while not (self.lost or self.stopped.is_set() or self.sequence > self.sent
+                           or (self.closing and not self.pending and end is None)
+                           or (end is not None and self.acknowledged >= end)):
+                    self.condition.wait()
+                # The collector closes the connection after acknowledging the end, so that is checked first
+                if end is not None and self.acknowledged >= end:
+                    return True
+                if self.lost or self.stopped.is_set():
+                    return False
+                batches = [batch for sequence, _, batch in self.pending if sequence > self.sent]
+                rows = sum(rows for sequence, rows, _ in self.pending if sequence > self.sent)
+                self.sent = self.sequence
+                if self.closing and not self.pending and end is None:
+                    end = self.sequence + 1
+                    batches.append(frame(END, _ack.pack(end)))
+            for batch in batches:
+                connection.sendall(batch)
+                self.bytes += len(batch)
+            self.rows += rows
+
+    def _read(self, connection):
+        """ Reads the acknowledgements of the collector """
+        try:
+            while True:
+                kind, payload = self._read_frame(connection)
+                if kind == ACK:
+                    self._acknowledge(_ack.unpack(payload)[0])
+        except (OSError, struct.error):
+            with self.condition:
+                self.lost = True
+                self.condition.notify_all()
+
+    def _read_frame(self, connection):
+        kind, length = _frame.unpack(_recv_exact(connection, _frame.size))
+        return kind, _recv_exact(connection, length)
+
+    def _acknowledge(self, sequence):
+        """ Drops the batches up to sequence from the backlog """
+        with self.condition:
+            if sequence > self.acknowledged:
+                self.acknowledged = sequence
+            while self.pending and self.pending[0][0] <= sequence:
+                _, _, batch = self.pending.popleft()
+                self.pending_bytes -= len(batch)
+            self.condition.notify_all()
+
+    def stats(self):
+        return {"server": "{}:{}".format(*self.address),
+                "unit": self.hello["unit"],
+                "rows": self.rows,
+                "bytes": self.bytes,
+                "batches": self.sequence,
+                "acknowledged": self.acknowledged,
+                "backlog": len(self.pending),
+                "backlog_bytes": self.pending_bytes,
+                "dropped": self.dropped,
+                "connects": self.connects,
+                "disconnects": self.disconnects}
+
+class Session:
+    """ Segmented storage of one session of a unit on the collector. """
+
+    def __init__(self, output):
+        self.output = output
+        self.last = 0 # Last batch written
+        self.rows = 0
+        self.bytes = 0
+        self.connection = None # Writer of the connection that sends the session
+
+class Collector:
+    """ Accepts the connections of many units and stores their sessions as segment files. """
+
+    max_ended = 1000 # Ended sessions remembered. An older one is continued from its index if its END comes again
+
+    def __init__(self, output_dir, compression=None, segment_size=0, segment_time=0, flush_interval=1.0):
+        self.output_dir = output_dir
+        self.compression = compression
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.flush_interval = flush_interval # Seconds between flushes of the segments and their indexes
+        self.sessions = {} # Open sessions by (unit, session)
+        self.ended = OrderedDict() # Sequence numbers of the END of the sessions that ended, by (unit, session)
+        self.server = None
+        self.connections = 0
+        self.rows = 0
+        self.bytes = 0
+        self.duplicates = 0 # Batches that were sent again after a reconnect and skipped
+        self.rejected = 0 # Connections closed because of an invalid HELLO
+
+    async def serve(self, host="", port=default_port, ready=None):
+        """ Serves until cancelled. ready is called with the port once the collector listens. """
+        self.server = await asyncio.start_server(self._handle, host or None, port)
+        if ready is not None:
+            ready(self.server.sockets[0].getsockname()[1])
+        flusher = asyncio.create_task(self._flush())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            flusher.cancel()
+            self.close()
+
+    def _open(self, key, hello):
+        if key not in self.sessions:
+            file_format = get_format(hello["format"])
+            directory = os.path.join(self.output_dir, hello["unit"])
+            os.makedirs(directory, exist_ok=True)
+            info = dict(hello["info"], unit=hello["unit"])
+            # A session that was stored before the collector restarted is continued
+            output = SegmentedOutput(os.path.join(directory, hello["session"] + file_format.extension),
+                                     file_format, hello["columns"], info,
+                                     self.compression, self.segment_size, self.segment_time, resume=True)
+            session = Session(output)
+            session.last = output.info.get("last_batch", 0)
+            self.sessions[key] = session
+        return self.sessions[key]
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        session = None
+        try:
+            kind, payload = await self._read_frame(reader)
+            if kind != HELLO:
+                return
+            try:
+                hello = json.loads(payload.decode())
+                # The unit and session come from the network and become a directory and a file name
+                key = (check_name(hello["unit"]), check_name(hello["session"]))
+                get_format(hello["format"])
+            except (ValueError, KeyError, TypeError):
+                self.rejected += 1
+                return
+            if key in self.ended:
+                # The unit did not get the acknowledgement of its END, so it is sent again
+                writer.write(frame(ACK, _ack.pack(self.ended[key])))
+                await self._read_frame(reader)
+                writer.write(frame(ACK, _ack.pack(self.ended[key])))
+                await writer.drain()
+                return
+            session = self._open(key, hello)
+            if session.connection is not None:
+                # The unit reconnected before the old connection was noticed as broken
+                session.connection.close()
+            session.connection = writer
+            writer.write(frame(ACK, _ack.pack(session.last)))
+            while True:
+                kind, payload = await self._read_frame(reader)
+                if kind == DATA:
+                    sequence, first_time, last_time, rows = _batch.unpack_from(payload)
+                    if sequence > session.last:
+                        data = payload[_batch.size:]
+                        session.output.write(data, first_time, last_time, rows)
+                        session.last = sequence
+                        # Goes into the index, so the session can be continued after a restart
+                        session.output.info["last_batch"] = sequence
+                        session.rows += rows
+                        session.bytes += len(data)
+                        self.rows += rows
+                        self.bytes += len(data)
+                    else:
+                        self.duplicates += 1
+                    writer.write(frame(ACK, _ack.pack(session.last)))
+                elif kind == END:
+                    session.output.close()
+                    del self.sessions[key]
+                    self.ended[key] = _ack.unpack(payload)[0]
+                    if len(self.ended) > self.max_ended:
+                        self.ended.popitem(last=False)
+                    session.connection = None
+                    writer.write(frame(ACK, payload))
+                    await writer.drain()
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # The unit went away, or the collector is stopping
+            pass
+        finally:
+            if session is not None and session.connection is writer:
+                session.connection = None
+            writer.close()
+
+    async def _read_frame(self, reader):
+        kind, length = _frame.unpack(await reader.readexactly(_frame.size))
+        return kind, await reader.readexactly(length)
+
+    async def _flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for session in list(self.sessions.values()):
+                session.output.flush()
+
+    def close(self):
+        """ Closes the segments of the sessions that did not end. """
+        for session in self.sessions.values():
+            session.output.close()
+        self.sessions = {}
+
+    def stats(self):
+        return {"connections": self.connections,
+                "sessions": len(self.sessions),
+                "rows": self.rows,
+                "bytes": self.bytes,
+                "duplicates": self.duplicates,
+                "rejected": self.rejected}
+
+async def _serve(collector, host, port, ready):
+    """ Serves until SIGINT or SIGTERM, which close the segments of the sessions that did not end """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        await collector.serve(host, port, ready)
+    except asyncio.CancelledError:
+        pass
+
+def serve(output_dir, host="", port=default_port, ready=None, **kwargs):
+    """ Runs a collector until the process gets SIGINT or SIGTERM, and returns it. """
+    collector = Collector(output_dir, **kwargs)
+    asyncio.run(_serve(collector, host, port, ready))
+    return collector
+
+def _serve_child(output_dir, connection):
+    """ Runs a collector for bench, and sends its port over connection """
+    serve(output_dir, "localhost", 0, connection.send)
+
+def _unit_child(address, unit, rows, batch, width, file_format, connection):
+    """ Sends rows as one simulated unit for bench, and sends its statistics over connection """
+    from array import array
+    encoder = get_format(file_format)
+    columns = ["time"] + ["value_{}".format(column) for column in range(1, width)]
+    output = NetworkOutput(address, unit, "bench", encoder, columns)
+    data = encoder.encode(array("d", range(batch * width)), width)
+    connection.recv() # Waits for the start, so all units send at once
+    for number in range(rows // batch):
+        output.write(data, number, number, batch)
+    output.close()
+    connection.send(output.stats())
+
+def bench(units, rows, batch=100, width=10, file_format="binary"):
+    """ Sends rows from a number of simulated units, each a process of its own, to a collector process
+    and returns the throughput. """
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        receiver, sender = context.Pipe(duplex=False)
+        collector = context.Process(target=_serve_child, args=(os.path.join(directory, "collector"), sender), daemon=True)
+        collector.start()
+        address = ("localhost", receiver.recv())
+        connections = []
+        processes = []
+        for unit in range(units):
+            parent, child = context.Pipe()
+            process = context.Process(target=_unit_child, daemon=True,
+                                      args=(address, "unit{}".format(unit), rows, batch, width, file_format, child))
+            process.start()
+            connections.append(parent)
+            processes.append(process)
+        start = perf_counter()
+        for connection in connections:
+            connection.send(True)
+        results = [connection.recv() for connection in connections]
+        elapsed = perf_counter() - start
+        for process in processes:
+            process.join()
+        collector.terminate()
+        collector.join()
+        stored = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(".index.json"):
+                    with open(os.path.join(root, name)) as f:
+                        stored += sum(segment["rows"] for segment in json.load(f)["segments"])
+    sent = sum(result["rows"] for result in results)
+    return {"units": units,
+            "rows": sent,
+            "dropped": sum(result["dropped"] for result in results),
+            "disconnects": sum(result["disconnects"] for result in results),
+            "seconds": elapsed,
+            "rows_per_s": sent / elapsed,
+            "mb_per_s": sum(result["bytes"] for result in results) / elapsed / 1e6,
+            "stored": stored}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    server = commands.add_parser("serve", help="run a collector")
+    server.add_argument("--host", default="", help="address to listen on (default all)")
+    server.add_argument("--port", type=int, default=default_port, help="port to listen on")
+    server.add_argument("-o", "--output", default="", help="directory the sessions of the units are written to")
+    server.add_argument("-z", "--compress", choices=["gzip", "lzma"], help="compress the segment files")
+    server.add_argument("--segment-size", type=float, default=0, help="start a new segment file after this many MB")
+    server.add_argument("--segment-time", type=float, default=0, help="start a new segment file after this many seconds")
+    server.add_argument("--flush-interval", type=float, default=1.0, help="seconds between flushes of the segments")
+    timing = commands.add_parser("bench", help="measure the throughput of a collector over localhost")
+    timing.add_argument("--units", nargs="+", type=int, default=[1, 4, 16], help="numbers of simulated units")
+    timing.add_argument("--rows", type=int, default=100000, help="rows sent by every unit")
+    timing.add_argument("--batch", type=int, default=100, help="rows per batch")
+    timing.add_argument("--width", type=int, default=10, help="values per row")
+    timing.add_argument("-f", "--format", default="binary", choices=["csv", "binary"], help="format of the data")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        collector = serve(args.output, args.host, args.port, lambda port: print("Listening on port", port, flush=True),
+                          compression=args.compress, segment_size=int(args.segment_size * 1e6),
+                          segment_time=args.segment_time, flush_interval=args.flush_interval)
+        print(json.dumps(collector.stats()))
+        return 0
+    for units in args.units:
+        result = bench(units, args.rows, args.batch, args.width, args.format)
+        print("{units:>3} units: {rows_per_s:10.0f} rows/s  {mb_per_s:7.1f} MB/s  "
+              "{seconds:.2f} s  {stored} stored  {dropped} dropped  {disconnects} disconnects".format(**result))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+""" Replays a recorded session as if it came from the Sense HAT.
+
+The sensors return the values of a CSV data file written by the DataCollector,
+one row per collection, so a recorded workload can be run through the
+collection, aggregation and writing again without a Sense HAT. A row is used
+until a sensor is read a second time, which starts the next row. The rows are
+replayed at the recorded rate, faster or slower, or as fast as they are read.
+Collect with a delay of 0 to let the recording set the pace. Sensors that were
+not read in a row keep their last value, like the real sensors, and sensors
+that are not in the recording return NaN. At the end of the recording the
+collection is stopped, or the recording starts again.
+
+It is selected with DATACOLLECTOR_BACKEND=replay and set up with environment
+variables, or with the --replay and --speed options of collect.py:
+
+    REPLAY_FILE   The CSV file to replay, may be compressed with gzip or lzma
+    REPLAY_SPEED  1 replays at the recorded rate, 2 twice as fast, 0 as fast
+                  as possible (default 1)
+    REPLAY_LOOP   1 starts the recording again at the end instead of stopping
+"""
+from time import monotonic, sleep
+import gzip
+import lzma
+import math
+import os
+
+# The joystick and the LED matrix are those of the fake device
+from fakesense import (DIRECTION_UP, DIRECTION_DOWN, DIRECTION_LEFT, DIRECTION_RIGHT, DIRECTION_MIDDLE,
+                       ACTION_PRESSED, ACTION_RELEASED, ACTION_HELD, InputEvent, SenseStick, FakeIMU)
+import fakesense
+
+nan = float("nan")
+
+_openers = {".gz": gzip.open, ".xz": lzma.open}
+
+# Columns of every value the IMU returns
+imu_columns = {"accel": ["accel_x", "accel_y", "accel_z"],
+               "gyro": ["gyro_x", "gyro_y", "gyro_z"],
+               "fusionPose": ["roll", "pitch", "yaw"], # In radians on the IMU, in degrees in the file
+               "compass": ["mag_x", "mag_y", "mag_z"]}
+
+class Recording:
+    """ Reads the rows of a CSV data file one at a time. """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = _openers.get(os.path.splitext(file_name)[1], open)(file_name, "rt")
+        self.columns = [column.strip() for column in self.file.readline().split(",")]
+        self.start = self.file.tell()
+
+    def next_row(self):
+        """ Returns the next row as floats, NaN for empty cells, or None at the end of the file. """
+        line = self.file.readline()
+        if not line.endswith("\n"):
+            return None # The end of the file or a partly written line
+        return [float(value) if value else nan for value in line[:-1].split(",")]
+
+    def rewind(self):
+        self.file.seek(self.start)
+
+    def close(self):
+        self.file.close()
+
+class ReplayIMU(FakeIMU):
+    """ IMU that returns the values of the current row. """
+
+    def IMURead(self):
+        self.reads += 1
+        self.sense._advance("imu")
+        return True
+
+    def getIMUData(self):
+        data = {}
+        recorded = self.sense.recording.columns
+        for key, columns in imu_columns.items():
+            values = [self.sense.last.get(column, nan) for column in columns]
+            # Readings that are not in the recording are valid NaN, so the DataCollector does not keep its last value
+            valid = all(value == value or column not in recorded for column, value in zip(columns, values))
+            if key == "fusionPose" and valid:
+                values = [math.radians(value) for value in values]
+            data[key] = tuple(values)
+            data[key + "Valid"] = valid
+        return data
+
+class SenseHat(fakesense.SenseHat):
+    """ Sense HAT that replays a recorded session. """
+
+    file_name = os.environ.get("REPLAY_FILE")
+    speed = float(os.environ.get("REPLAY_SPEED", 1))
+    loop = os.environ.get("REPLAY_LOOP", "0") not in ("", "0")
+
+    def __init__(self):
+        super().__init__()
+        if not self.file_name:
+            raise ValueError("Set REPLAY_FILE to the data file to replay")
+        self.recording = Recording(self.file_name)
+        self._imu = ReplayIMU(self)
+        self.row = None # The row that is replayed
+        self.pending = self._next_row() # The row after it, read ahead to know when the recording ends
+        if self.pending is None:
+            raise ValueError("{} has no data to replay".format(self.file_name))
+        self.used = set() # Sensors that were read from the row
+        self.last = {} # Last value of every column that was not NaN
+        self.origin = None # Recorded time and monotonic time of the first row, to keep the pace
+        self.rows = 0 # Rows replayed
+        self.finished = False
+
+    def _next_row(self):
+        row = self.recording.next_row()
+        if row is None and self.loop:
+            self.recording.rewind()
+            row = self.recording.next_row()
+        return row
+
+    def _advance(self, sensor):
+        """ Moves to the next row if the sensor was read from the current one """
+        self._wait(sensor)
+        if self.row is not None and sensor not in self.used:
+            self.used.add(sensor)
+            return
+        self.used = {sensor}
+        row = self.pending
+        if row is None:
+            return # The end of the recording, the last values stay
+        self.pending = self._next_row()
+        if self.pending is None:
+            # Stops after the collection of the last row
+            self._finish()
+        if self.row is not None and row[0] < self.row[0]:
+            self.origin = None # The recording started again
+        self.row = row
+        self.rows += 1
+        for column, value in zip(self.recording.columns, row):
+            if value == value:
+                self.last[column] = value
+        if self.speed:
+            if self.origin is None:
+                self.origin = (row[0], monotonic())
+            # Waits until the time of the row at the replay speed
+            delay = self.origin[1] + (row[0] - self.origin[0]) / self.speed - monotonic()
+            if delay > 0:
+                sleep(delay)
+
+    def _finish(self):
+        """ Stops the collection at the end of the recording """
+        self.finished = True
+        # The DataCollector is this object, so its collection can be stopped from here
+        stop = getattr(self, "stop", None)
+        if stop is not None:
+            stop()
+
+    def get_temperature(self):
+        self._advance("temperature")
+        return self.last.get("temp", nan)
+
+    def get_pressure(self):
+        self._advance("pressure")
+        return self.last.get("pressure", nan)
+
+    def get_humidity(self):
+        self._advance("humidity")
+        return self.last.get("humidity", nan)
@@ -0,0 +1,139 @@
+from array import array
+from multiprocessing import shared_memory
+from threading import Event
+
+class SampleBuffer:
+    """ Preallocated ring of float64 values with one column per channel.
+
+    The collecting thread puts rows into the ring and the writer thread reads
+    them in batches, so no objects are kept per collection. There is one
+    producer and one consumer: only the producer moves head and only the
+    consumer moves tail, so putting a row takes no lock. """
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.data = array("d", bytes(8 * width * capacity))
+        self.view = memoryview(self.data)
+        self.head = 0 # Number of rows put into the ring
+        self.tail = 0 # Number of rows released by the consumer
+        self.ready = Event() # Set when the ring is half full
+        self.space = Event() # Set when the consumer releases rows
+        self.half = max(capacity // 2, 1)
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def full(self):
+        return self.head - self.tail >= self.capacity
+
+    def put(self, row):
+        """ Copies a row of values into the ring. The ring must not be full. """
+        start = (self.head % self.capacity) * self.width
+        self.data[start:start + self.width] = array("d", row)
+        self.head += 1
+        if self.head - self.tail == self.half:
+            self.ready.set()
+
+    def wait_for_space(self, timeout=None):
+        """ Blocks until the ring is not full. Returns False if it timed out. """
+        while self.full():
+            self.ready.set()
+            self.space.clear()
+            if self.full() and not self.space.wait(timeout):
+                return False
+        return True
+
+    def wait_for_rows(self, timeout=None):
+        """ Blocks until the ring is half full or the timeout has passed. """
+        self.ready.wait(timeout)
+        self.ready.clear()
+
+    def peek(self):
+        """ Returns the waiting rows as one or two flat memoryviews without copying them.
+
+        The rows stay valid until they are given back with release. """
+        count = self.head - self.tail
+        first = self.tail % self.capacity
+        last = first + count
+        if last <= self.capacity:
+            chunks = [self.view[first * self.width:last * self.width]]
+        else:
+            chunks = [self.view[first * self.width:],
+                      self.view[:(last - self.capacity) * self.width]]
+        return [chunk for chunk in chunks if len(chunk)], count
+
+    def release(self, count):
+        """ Frees the space of rows returned by peek. """
+        self.tail += count
+        self.space.set()
+
+class SharedEvent:
+    """ Event between processes that never waits for the other process.
+
+    multiprocessing.Event.set waits for the processes that are waiting on it to
+    wake up, so it blocks forever if one of them was killed. This event keeps
+    its flag in shared memory and wakes a waiter by releasing a semaphore. A
+    waiter can wake up early, so callers check their condition again. """
+
+    def __init__(self, buffer, index, context):
+        self.buffer = buffer # The flag is buffer.counters[index]
+        self.index = index
+        self.wakeup = context.Semaphore(0)
+
+    def is_set(self):
+        return bool(self.buffer.counters[self.index])
+
+    def set(self):
+        if not self.buffer.counters[self.index]:
+            self.buffer.counters[self.index] = 1
+            self.wakeup.release()
+
+    def clear(self):
+        self.buffer.counters[self.index] = 0
+
+    def wait(self, timeout=None):
+        if not self.buffer.counters[self.index]:
+            self.wakeup.acquire(timeout=timeout)
+        return bool(self.buffer.counters[self.index])
+
+class SharedSampleBuffer(SampleBuffer):
+    """ SampleBuffer in shared memory, for a consumer in another process.
+
+    The values, the head and tail counters and the flags of the events are kept
+    in a multiprocessing.shared_memory block, see SharedEvent. The consumer has
+    to be forked after the buffer is made. """
+
+    def __init__(self, width, capacity, context):
+        self.width = width
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=8 * (4 + width * capacity))
+        self.counters = self.memory.buf[:32].cast("q") # head, tail and the flags of ready and space
+        self.data = self.view = self.memory.buf[32:].cast("d")
+        self.ready = SharedEvent(self, 2, context)
+        self.space = SharedEvent(self, 3, context)
+        self.half = max(capacity // 2, 1)
+
+    @property
+    def head(self):
+        return self.counters[0]
+
+    @head.setter
+    def head(self, value):
+        self.counters[0] = value
+
+    @property
+    def tail(self):
+        return self.counters[1]
+
+    @tail.setter
+    def tail(self, value):
+        self.counters[1] = value
+
+    def close(self):
+        """ Frees the shared memory. Only called by the process that made the buffer. """
+        counters, self.counters = self.counters, self.counters.tolist() # Keeps the counts for the statistics
+        counters.release()
+        self.view.release()
+        self.memory.close()
+        self.memory.unlink()
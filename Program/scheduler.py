@@ -0,0 +1,91 @@
+from time import monotonic, sleep
+
+# Policies for missed deadlines
+SKIP = "skip"         # Drop the missed ticks and wait for the next one on the grid
+CATCH_UP = "catchup"  # Run the missed ticks back to back until the schedule is met
+
+class Scheduler:
+    """ Paces a loop at a fixed rate using absolute monotonic deadlines.
+
+    Deadlines are placed on a fixed grid (start + n * period), so the time
+    spent reading and logging a sample does not add to the period. """
+
+    stop_interval = 0.05 # Shortest sleep that is cut short by a stop
+
+    def __init__(self, period, policy=SKIP):
+        if policy not in (SKIP, CATCH_UP):
+            raise ValueError("Unknown overrun policy: {}".format(policy))
+        self.period = period
+        self.policy = policy
+        self.deadline = None
+        self.ticks = 0
+        self.overruns = 0   # Number of ticks that started after their deadline
+        self.skipped = 0    # Number of ticks dropped by the skip policy
+        self.max_lateness = 0.0
+        self._lateness_mean = 0.0
+        self._lateness_m2 = 0.0
+
+    def wait(self, stop=None):
+        """ Sleeps until the next deadline and returns how late the tick started in seconds.
+
+        With a threading.Event as stop, a sleep longer than stop_interval ends as
+        soon as it is set, so a stop does not wait for the rest of a long period.
+        Shorter sleeps use time.sleep, which wakes up more precisely. """
+        delay = self.advance()
+        if delay > 0:
+            if stop is None or delay < self.stop_interval:
+                sleep(delay)
+            else:
+                stop.wait(delay)
+        return self.tick()
+
+    def advance(self):
+        """ Moves on to the next deadline and returns the seconds until it.
+
+        wait() is advance(), a sleep and tick(). They are separate so a caller
+        can do the sleeping itself, e.g. with asyncio.sleep. """
+        now = monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        else:
+            self.deadline += self.period
+        if self.period <= 0:
+            # Free running, there is no schedule to keep
+            self.deadline = now
+            return 0.0
+        if now > self.deadline:
+            self.overruns += 1
+            if self.policy == SKIP:
+                missed = int((now - self.deadline) / self.period) + 1
+                self.skipped += missed
+                self.deadline += missed * self.period
+        return self.deadline - monotonic()
+
+    def tick(self):
+        """ Records the start of the tick and returns how late it is in seconds. """
+        if self.period <= 0:
+            self.ticks += 1
+            return 0.0
+        lateness = max(monotonic() - self.deadline, 0.0)
+        self._record(lateness)
+        return lateness
+
+    def _record(self, lateness):
+        """ Updates the jitter statistics with Welford's running variance. """
+        self.ticks += 1
+        diff = lateness - self._lateness_mean
+        self._lateness_mean += diff / self.ticks
+        self._lateness_m2 += diff * (lateness - self._lateness_mean)
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def stats(self):
+        """ Returns a dictionary with the overrun and jitter statistics of the session. """
+        std = (self._lateness_m2 / self.ticks) ** 0.5 if self.ticks else 0.0
+        return {"period": self.period,
+                "policy": self.policy,
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+                "skipped": self.skipped,
+                "jitter_mean": self._lateness_mean,
+                "jitter_std": std,
+                "jitter_max": self.max_lateness}
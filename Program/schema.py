@@ -0,0 +1,99 @@
+""" The channels of a session and how they are read.
+
+Every sensor is listed once in sensor_table, with the columns it adds to a
+collection and how it is read. file_setup makes a Schema of the enabled
+sensors, whose columns are the header of the data file, the width of the rows
+the writer formats and the columns the aggregation, trigger and spectrum stages
+work on. The schema is compiled into a flat list of readers, one per sensor,
+that get_sense_data calls in turn. Each reader appends the values of its
+sensor to the row, so a collection does not look up which sensors are enabled.
+
+A new sensor only needs an entry in sensor_table and, if it is not read from
+the IMU, a method of the DataCollector that reads it.
+"""
+from collections import namedtuple
+from time import monotonic
+
+dtype = "<f8" # Every value of every column is stored as a little endian float64, see formats.py
+
+nan = float("nan")
+
+# imu is the key of the reading in DataCollector.last_imu for the sensors read from the IMU,
+# read the name of the DataCollector method that reads the other sensors
+Sensor = namedtuple("Sensor", ["letter", "columns", "imu", "read"])
+
+sensor_table = [Sensor("A", ("accel_x", "accel_y", "accel_z"), "accel", None),
+                Sensor("T", ("temp",), None, "get_temperature"),
+                Sensor("P", ("pressure",), None, "get_pressure"),
+                Sensor("H", ("humidity",), None, "get_humidity"),
+                Sensor("G", ("gyro_x", "gyro_y", "gyro_z"), "gyro", None),
+                Sensor("O", ("pitch", "roll", "yaw"), "orientation", None),
+                Sensor("M", ("mag_x", "mag_y", "mag_z"), "compass", None)]
+
+sensor_letters = "".join(sensor.letter for sensor in sensor_table)
+
+class Schema:
+    """ The columns of the given sensors, after the time, in the order of sensor_table. """
+
+    def __init__(self, letters):
+        unknown = [letter for letter in letters if letter not in sensor_letters]
+        if unknown:
+            raise ValueError("Unknown sensors: {}".format("".join(unknown)))
+        self.sensors = [sensor for sensor in sensor_table if sensor.letter in letters]
+        self.letters = "".join(sensor.letter for sensor in self.sensors)
+        self.columns = ["time"] + [column for sensor in self.sensors for column in sensor.columns]
+        self.width = len(self.columns)
+
+    def compile(self, collector):
+        """ Returns the readers of a collection for the DataCollector collector.
+
+        Every reader is called with the row and appends the values of its sensor.
+        Sensors with a rate in collector.rates are appended as NaN when they are
+        not due, and the IMU is read once for all of its sensors. """
+        rated = [sensor.letter for sensor in self.sensors if collector.rates.get(sensor.letter)]
+        imu = [sensor.letter for sensor in self.sensors if sensor.imu]
+        due = {} # Whether each sensor in rated is due at this collection
+        readers = []
+        if rated:
+            def check(row):
+                now = monotonic()
+                for letter in rated:
+                    due[letter] = collector._is_due(letter, now)
+            readers.append(check)
+        if imu:
+            if all(letter in rated for letter in imu):
+                def read_imu(row):
+                    if any(due[letter] for letter in imu):
+                        collector._timed_read("read_imu", collector.read_imu)
+            else:
+                def read_imu(row):
+                    collector._timed_read("read_imu", collector.read_imu)
+            readers.append(read_imu)
+        for sensor in self.sensors:
+            if sensor.imu:
+                reader = _imu_reader(collector.last_imu, sensor.imu)
+            else:
+                reader = _timed_reader(collector, "read_" + sensor.letter, getattr(collector, sensor.read))
+            if sensor.letter in rated:
+                reader = _due_reader(reader, due, sensor.letter, [nan] * len(sensor.columns))
+            readers.append(reader)
+        return readers
+
+def _imu_reader(last_imu, key):
+    """ Appends the last IMU reading of key, which the IMU reader of the collection updated """
+    def read(row):
+        row.extend(last_imu[key])
+    return read
+
+def _timed_reader(collector, name, method):
+    def read(row):
+        row.append(collector._timed_read(name, method))
+    return read
+
+def _due_reader(reader, due, letter, missing):
+    def read(row):
+        if due[letter]:
+            reader(row)
+        else:
+            row.extend(missing)
+    return read
@@ -0,0 +1,154 @@
+""" Outputs the writer sends the encoded data to.
+
+FileOutput appends to the single data file made by file_setup. SegmentedOutput
+splits a session into numbered segment files that can be compressed with gzip
+or lzma and are started anew after a given size or time. Every segment starts
+with the header of the file format, so it can be read on its own, and an index
+file maps the time range of each segment to its file name:
+
+    AT-2018-06-01 12:00:00.index.json
+    AT-2018-06-01 12:00:00.0001.csv.gz
+    AT-2018-06-01 12:00:00.0002.csv.gz
+"""
+import gzip
+import json
+import lzma
+import os
+
+compressions = {None: "", "gzip": ".gz", "lzma": ".xz"}
+
+class FileOutput:
+    """ Appends to a single uncompressed data file. """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, "ab")
+
+    def write(self, data, first_time, last_time, rows):
+        if isinstance(data, str):
+            data = data.encode()
+        self.file.write(data)
+
+    def flush(self, sync=False):
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self, sync=False):
+        self.flush(sync)
+        self.file.close()
+
+class SegmentedOutput:
+    """ Writes the data to numbered, optionally compressed segment files with an index. """
+
+    def __init__(self, file_name, file_format, columns, info=None, compression=None, segment_size=0, segment_time=0,
+                 resume=False):
+        if compression not in compressions:
+            raise ValueError("Unknown compression: {}".format(compression))
+        self.base, self.extension = os.path.splitext(file_name)
+        self.file_format = file_format
+        self.columns = list(columns)
+        self.info = dict(info or {})
+        self.compression = compression
+        # Bytes on disk before a new segment is started, 0 has no limit. Compressors hold back
+        # some data, lzma in particular, so segments can end up somewhat larger than this
+        self.segment_size = segment_size
+        self.segment_time = segment_time # Seconds of data before a new segment is started, 0 has no limit
+        self.index_name = self.base + ".index.json"
+        self.segments = [] # One entry per segment in the index
+        self.raw = None
+        self.file = None
+        if resume and os.path.exists(self.index_name):
+            # Continues after the segments in the index, with a new segment
+            with open(self.index_name) as f:
+                index = json.load(f)
+            self.segments = index["segments"]
+            for key, value in index.items():
+                if key not in ("format", "compression", "columns", "segments"):
+                    self.info.setdefault(key, value)
+
+    def _open_segment(self):
+        """ Starts the next segment with the header of the file format """
+        name = "{}.{:04d}{}{}".format(self.base, len(self.segments) + 1, self.extension, compressions[self.compression])
+        self.raw = open(name, "wb")
+        if self.compression == "gzip":
+            self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        elif self.compression == "lzma":
+            self.file = lzma.LZMAFile(self.raw, "wb")
+        else:
+            self.file = self.raw
+        header = self.file_format.header(self.columns, self.info)
+        self.file.write(header.encode() if isinstance(header, str) else header)
+        self.segments.append({"file": os.path.basename(name),
+                              "first_time": None,
+                              "last_time": None,
+                              "rows": 0,
+                              "bytes": 0,
+                              "complete": False})
+        self._write_index()
+
+    def _close_segment(self, sync=False):
+        if self.file is not self.raw:
+            # Ends the compressed stream, the segment file itself stays open
+            self.file.close()
+        self.raw.flush()
+        if sync:
+            os.fsync(self.raw.fileno())
+        segment = self.segments[-1]
+        segment["bytes"] = self.raw.tell()
+        segment["complete"] = True
+        self.raw.close()
+        self.file = self.raw = None
+        self._write_index()
+
+    def _is_full(self, first_time):
+        segment = self.segments[-1]
+        if self.segment_size and self.raw.tell() >= self.segment_size:
+            return True
+        if self.segment_time and segment["first_time"] is not None:
+            return first_time - segment["first_time"] >= self.segment_time
+        return False
+
+    def write(self, data, first_time, last_time, rows):
+        """ Writes encoded rows whose time column goes from first_time to last_time. """
+        if self.file is not None and self._is_full(first_time):
+            self._close_segment()
+        if self.file is None:
+            self._open_segment()
+        self.file.write(data.encode() if isinstance(data, str) else data)
+        segment = self.segments[-1]
+        if segment["first_time"] is None:
+            segment["first_time"] = first_time
+        segment["last_time"] = last_time
+        segment["rows"] += rows
+
+    def flush(self, sync=False):
+        if self.file is None:
+            return
+        # lzma can only be flushed by ending the stream, so its data is safe once the segment is closed
+        if self.compression != "lzma":
+            self.file.flush()
+            if self.file is not self.raw:
+                self.raw.flush()
+            if sync:
+                os.fsync(self.raw.fileno())
+        self.segments[-1]["bytes"] = self.raw.tell()
+        self._write_index()
+
+    def close(self, sync=False):
+        if self.file is not None:
+            self._close_segment(sync)
+        else:
+            self._write_index()
+
+    def _write_index(self):
+        """ Replaces the index file in one step so readers never see half a file """
+        index = dict(self.info)
+        index.update({"format": self.file_format.name,
+                      "compression": self.compression,
+                      "columns": self.columns,
+                      "segments": self.segments})
+        temporary = self.index_name + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temporary, self.index_name)
@@ -0,0 +1,302 @@
+""" Finds the sessions in a data directory and loads them as NumPy arrays.
+
+A session is a single data file named after its sensors and creation time,
+
+    AT-2018-06-01 12:00:00.csv     (or .dcb)
+
+or a segmented session with an index file, see segments.py. The summary
+(<base>.json) and the live stats (<base>.stats.json) are not sessions, but the
+summary gives the exact start of the collection, which the times in the data
+are relative to. Without a summary the creation time in the file name is used.
+
+The data is read in chunks, and only the requested columns and rows are kept,
+so large archives can be queried without loading them whole. Uncompressed files
+are searched for the start of a time range instead of being read from the
+beginning, and segments outside the range are not opened at all. Every array
+has a "timestamp" field with the absolute time, the "time" field with the
+seconds since the start, and one field per requested column.
+
+    python sessions.py list /home/pi/data
+    python sessions.py export /home/pi/data --start "2018-06-01 12:00" --end "2018-06-01 13:00" \\
+        --columns temp,humidity --output hour.csv
+"""
+from datetime import datetime, timedelta
+import argparse
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import sys
+
+from formats import CsvFormat, read_header, read_records
+
+_name = re.compile(r"^(?P<sensors>[ATPHGOM]+)-(?P<created>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?P<kind>\.csv|\.dcb|\.index\.json)$")
+_openers = {None: open, "gzip": gzip.open, "lzma": lzma.open}
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+class Session:
+    """ A session in a data directory. The data is only read by load and chunks. """
+
+    def __init__(self, path):
+        match = _name.match(os.path.basename(path))
+        if match is None:
+            raise ValueError("{} is not named like a DataCollector session".format(path))
+        self.path = path
+        self.sensors = match.group("sensors")
+        self.created = datetime.fromisoformat(match.group("created"))
+        self.base = path[:-len(match.group("kind"))]
+        self.index = None
+        if match.group("kind") == ".index.json":
+            with open(path) as f:
+                self.index = json.load(f)
+            self.format = self.index["format"]
+            self.compression = self.index["compression"]
+            self.columns = self.index["columns"]
+            self.window = self.index.get("window", 0)
+        else:
+            self.format = "csv" if match.group("kind") == ".csv" else "binary"
+            self.compression = None
+            self.columns, self.window = self._read_columns(path)
+        self.summary = None
+        if os.path.exists(self.base + ".json"):
+            with open(self.base + ".json") as f:
+                self.summary = json.load(f)
+        # The times in the data are relative to the start of the collection
+        self.start_time = _to_datetime(self.summary["start_time"]) if self.summary else self.created
+
+    def __repr__(self):
+        return "Session({!r})".format(self.path)
+
+    def _read_columns(self, path):
+        """ Returns the columns and the aggregation window of a data file """
+        if self.format == "binary":
+            header, _ = read_header(path)
+            return header["columns"], header.get("window", 0)
+        with open(path, "rb") as f:
+            columns = [column.strip() for column in f.readline().decode().split(",")]
+        return columns, 0
+
+    @property
+    def end_time(self):
+        """ Returns the time of the last collection if it is known, otherwise None. """
+        last = None
+        if self.summary:
+            last = self.summary["duration"]
+        elif self.index:
+            times = [segment["last_time"] for segment in self.index["segments"] if segment["last_time"] is not None]
+            last = max(times) if times else None
+        if last is None:
+            return None
+        return self.start_time + timedelta(seconds=last + self.window)
+
+    def files(self):
+        """ Returns the data files with the first and last time in them, None if unknown. """
+        if self.index is None:
+            return [(self.path, None, None)]
+        directory = os.path.dirname(self.path)
+        return [(os.path.join(directory, segment["file"]), segment["first_time"], segment["last_time"])
+                for segment in self.index["segments"] if segment["rows"]]
+
+    def _seconds(self, value):
+        """ Returns a time as seconds since the start of the session """
+        if value is None or isinstance(value, (int, float)):
+            return value
+        return (_to_datetime(value) - self.start_time).total_seconds()
+
+    def dtype(self, columns=None):
+        """ Returns the columns and the NumPy dtype of the arrays returned for them. """
+        import numpy as np
+        columns = list(self.columns[1:] if columns is None else columns)
+        missing = [column for column in columns if column not in self.columns]
+        if missing:
+            raise KeyError("{} has no column {}".format(self, ", ".join(missing)))
+        return columns, np.dtype([("timestamp", "datetime64[us]"), ("time", "<f8")] + [(column, "<f8") for column in columns])
+
+    def chunks(self, columns=None, start=None, end=None, chunk_rows=65536):
+        """ Yields the data from start up to end in arrays of at most about chunk_rows rows.
+
+        start and end are datetimes, ISO strings or seconds since the start of
+        the session. columns is a list of column names, None selects all. """
+        import numpy as np
+        columns, dtype = self.dtype(columns)
+        start, end = self._seconds(start), self._seconds(end)
+        origin = np.datetime64(self.start_time, "us")
+        for file_name, first_time, last_time in self.files():
+            if start is not None and last_time is not None and last_time < start:
+                continue
+            if end is not None and first_time is not None and first_time >= end:
+                break
+            if self.format == "binary":
+                reader = self._binary_chunks(file_name, chunk_rows, start)
+            else:
+                reader = self._csv_chunks(file_name, chunk_rows, start)
+            for data in reader:
+                time = data[self.columns[0]]
+                # The time column only grows, so the range is found by bisection
+                first = np.searchsorted(time, start) if start is not None else 0
+                last = np.searchsorted(time, end) if end is not None else len(time)
+                if first < last:
+                    out = np.empty(last - first, dtype)
+                    out["time"] = time[first:last]
+                    out["timestamp"] = origin + (out["time"] * 1e6).astype("timedelta64[us]")
+                    for column in columns:
+                        out[column] = data[column][first:last]
+                    yield out
+                if last < len(time):
+                    return
+
+    def load(self, columns=None, start=None, end=None):
+        """ Returns the data from start up to end as one array, see chunks. """
+        import numpy as np
+        chunks = list(self.chunks(columns, start, end))
+        if not chunks:
+            return np.empty(0, self.dtype(columns)[1])
+        return np.concatenate(chunks)
+
+    def _binary_chunks(self, file_name, chunk_rows, start):
+        import numpy as np
+        opener = _openers[self.compression]
+        if opener is open:
+            # Uncompressed files are mapped, so only the pages that are used are read
+            header, offset = read_header(file_name)
+            dtype = np.dtype([(column, header["dtype"]) for column in header["columns"]])
+            count = (os.path.getsize(file_name) - offset) // dtype.itemsize
+            data = np.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=(count,))
+            first = np.searchsorted(data[header["columns"][0]], start) if start is not None else 0
+            for row in range(first, count, chunk_rows):
+                yield data[row:row + chunk_rows]
+            return
+        with opener(file_name, "rb") as f:
+            # The records follow the header, which is read from the decompressing file as well
+            header, _ = read_header(f)
+            dtype = np.dtype([(column, header["dtype"]) for column in header["columns"]])
+            for data in read_records(f, dtype.itemsize, chunk_rows):
+                yield np.frombuffer(data, dtype)
+
+    def _csv_chunks(self, file_name, chunk_rows, start):
+        import numpy as np
+        opener = _openers[self.compression]
+        dtype = np.dtype([(column, "<f8") for column in self.columns])
+        width = len(self.columns)
+        with opener(file_name, "rb") as f:
+            f.readline() # The header
+            if opener is open and start is not None:
+                self._seek_time(f, start)
+            while True:
+                lines = f.readlines(chunk_rows * 16 * width)
+                if not lines:
+                    break
+                if not lines[-1].endswith(b"\n"):
+                    lines.pop() # A partly written line at the end of the file
+                    if not lines:
+                        break
+                # Empty cells are NaN. Runs of them need the second replace of ",,"
+                text = b"".join(lines).replace(b",\n", b",nan\n").replace(b"\n,", b"\nnan,")
+                text = text.replace(b",,", b",nan,").replace(b",,", b",nan,")
+                values = np.loadtxt(io.BytesIO(text), delimiter=",", dtype="<f8", ndmin=2)
+                yield values.reshape(-1).view(dtype)
+
+    def _seek_time(self, f, start, resolution=65536):
+        """ Moves an uncompressed CSV file to a line at or a little before the given time """
+        low = begin = f.tell()
+        high = f.seek(0, os.SEEK_END)
+        while high - low > resolution:
+            middle = (low + high) // 2
+            f.seek(middle)
+            f.readline() # The rest of a line
+            line_start = f.tell()
+            line = f.readline()
+            if line.endswith(b"\n") and float(line.split(b",", 1)[0]) < start:
+                low, begin = middle, line_start
+            else:
+                high = middle
+        f.seek(begin)
+
+def find_sessions(directory=".", recursive=False):
+    """ Returns the sessions in a directory sorted by their start time. """
+    sessions = []
+    for root, directories, names in os.walk(directory):
+        for name in names:
+            if _name.match(name):
+                sessions.append(Session(os.path.join(root, name)))
+        if not recursive:
+            break
+    return sorted(sessions, key=lambda session: session.start_time)
+
+def query(directory=".", start=None, end=None, columns=None, recursive=False):
+    """ Returns (session, array) for the sessions with data from start up to end and all the given columns. """
+    start = _to_datetime(start) if start is not None else None
+    end = _to_datetime(end) if end is not None else None
+    result = []
+    for session in find_sessions(directory, recursive):
+        if columns is not None and any(column not in session.columns for column in columns):
+            continue
+        if end is not None and session.start_time >= end:
+            continue
+        if start is not None and session.end_time is not None and session.end_time < start:
+            continue
+        data = session.load(columns, start, end)
+        if len(data):
+            result.append((session, data))
+    return result
+
+def export(results, file_name):
+    """ Writes query results to a CSV file with absolute timestamps, or a .npy file. """
+    import numpy as np
+    if len(set(data.dtype for session, data in results)) > 1:
+        raise ValueError("The sessions have different columns, select the columns to export")
+    if file_name.endswith(".npy"):
+        np.save(file_name, np.concatenate([data for session, data in results]))
+        return
+    csv = CsvFormat()
+    with open(file_name, "w") as out:
+        for number, (session, data) in enumerate(results):
+            names = data.dtype.names
+            if number == 0:
+                out.write(csv.header(names))
+            timestamps = np.datetime_as_string(data["timestamp"])
+            for row, timestamp in zip(data[list(names[1:])].tolist(), timestamps):
+                out.write(timestamp + "," + csv.encode(row, len(row)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="list the sessions in a directory")
+    listing.add_argument("directory", nargs="?", default=".")
+    listing.add_argument("-r", "--recursive", action="store_true")
+    exporting = commands.add_parser("export", help="write the data of a time range to a CSV or .npy file")
+    exporting.add_argument("directory", nargs="?", default=".")
+    exporting.add_argument("-r", "--recursive", action="store_true")
+    exporting.add_argument("--start", help="ISO time of the first collection")
+    exporting.add_argument("--end", help="ISO time after the last collection")
+    exporting.add_argument("--columns", type=lambda text: text.split(","), help="comma separated columns, e.g. temp,humidity")
+    exporting.add_argument("-o", "--output", required=True, help="CSV or .npy file")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for session in find_sessions(args.directory, args.recursive):
+            end = session.end_time
+            print("{} {} - {} {:6} {}".format(session.sensors.ljust(7), session.start_time.replace(microsecond=0),
+                                              end.replace(microsecond=0).time() if end else "?",
+                                              session.format, os.path.basename(session.path)))
+        return 0
+    results = query(args.directory, args.start, args.end, args.columns, args.recursive)
+    if not results:
+        print("No data in the range", file=sys.stderr)
+        return 1
+    try:
+        export(results, args.output)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print("{} rows from {} sessions".format(sum(len(data) for _, data in results), len(results)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+""" Vibration spectra of the accelerometer and gyroscope per time window.
+
+With a spectrum window set, the writer passes the collected rows through a
+Spectrum instead of writing them. For every window it takes the FFT of each of
+the accel_x/y/z and gyro_x/y/z columns that are collected, and writes one row
+with the energy in every frequency band and the peak frequency of each column:
+
+    time , accel_x_1-10Hz , accel_x_10-50Hz , ... , accel_x_peak_Hz , accel_y_1-10Hz , ...
+
+The energy of a band is the mean square of the signal in it, in g^2 for the
+accelerometer and (rad/s)^2 for the gyroscope, so the energies of all bands add
+up to the variance of the column. The sample rate is worked out from the times
+in the window, so the collection should run at a steady rate. Bands above half
+the sample rate are NaN. Optionally the vibration level of every column is
+passed to a function, which the DataCollector uses to draw it on the LED matrix.
+
+NumPy is only imported when a Spectrum is made.
+"""
+import math
+
+spectrum_channels = ["accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z"]
+default_bands = [(1, 10), (10, 50), (50, 100), (100, 250), (250, 500)]
+# RMS that lights a whole column of the LED matrix, and the factor between two pixels of it
+full_scale = {"accel": 1.0, "gyro": 2.0}
+level_step = 2.0
+
+nan = float("nan")
+
+def band_name(band):
+    return "{:g}-{:g}Hz".format(*band)
+
+def spectrum_columns(columns, bands=default_bands):
+    """ Returns the columns of the spectrum data for the given raw columns. """
+    channels = [column for column in spectrum_channels if column in columns]
+    names = [band_name(band) for band in bands] + ["peak_Hz"]
+    return [columns[0]] + ["{}_{}".format(channel, name) for channel in channels for name in names]
+
+def level_heights(channels, levels):
+    """ Returns the heights of the 8 columns of the LED matrix for the RMS levels of the channels.
+
+    The accelerometer is shown in the columns 0 to 2 and the gyroscope in 5 to 7.
+    Every pixel is a factor of level_step, so a column goes down to 1/128 of full scale. """
+    heights = [0] * 8
+    for channel, level in zip(channels, levels):
+        if not level > 0:
+            continue
+        kind, axis = channel.split("_")
+        column = "xyz".index(axis) + (0 if kind == "accel" else 5)
+        height = 8 + math.log(level / full_scale[kind], level_step)
+        heights[column] = max(0, min(8, math.ceil(height)))
+    return heights
+
+class Spectrum:
+    """ Band energies and peak frequencies of flat rows of the given columns per window of seconds. """
+
+    def __init__(self, columns, window, bands=default_bands, level=None):
+        import numpy as np
+        self.np = np
+        if window <= 0:
+            raise ValueError("The window must be longer than 0 seconds")
+        self.channels = [column for column in spectrum_channels if column in columns]
+        if not self.channels:
+            raise ValueError("The spectrum needs the accelerometer or the gyroscope")
+        self.indices = [columns.index(channel) for channel in self.channels]
+        self.width = len(columns)
+        self.out_width = 1 + len(self.channels) * (len(bands) + 1)
+        self.window = window
+        self.bands = list(bands)
+        self.level = level # Called with the RMS of every channel after each window, if set
+        self.key = None # Number of the current window
+        self.pending = [] # Arrays with the values of the channels in the current window, time first
+        self.rows = 0 # Rows added
+        self.windows = 0 # Spectra returned
+
+    def add(self, values):
+        """ Adds flat rows and returns the spectra of the windows they completed. """
+        np = self.np
+        out = []
+        rows = np.frombuffer(values, dtype="<f8").reshape(-1, self.width)
+        if not len(rows):
+            return np.empty(0)
+        # Only the time and the channels are kept, as a copy, since the rows are reused by the writer
+        data = rows[:, [0] + self.indices]
+        keys = np.floor(data[:, 0] / self.window)
+        # Splits the rows where a new window starts
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        for part, key in zip(np.split(data, starts), keys[np.concatenate(([0], starts))]):
+            if key != self.key:
+                if self.key is not None:
+                    out.append(self._emit())
+                self.key = key
+            self.pending.append(part)
+        self.rows += len(rows)
+        return np.concatenate(out) if out else np.empty(0)
+
+    def _emit(self):
+        """ Returns the spectra of the current window and starts a new one """
+        np = self.np
+        data = np.concatenate(self.pending)
+        self.pending = []
+        row = np.full(self.out_width, nan)
+        row[0] = self.key * self.window
+        levels = []
+        step = len(self.bands) + 1
+        if not np.isnan(data[:, 1:]).any():
+            # All channels are read at every collection, so they share one FFT
+            results = self._spectra(data[:, 0], data[:, 1:])
+        else:
+            # Channels with their own rate are worked out one by one from their own samples
+            results = []
+            for channel in range(1, data.shape[1]):
+                valid = ~np.isnan(data[:, channel])
+                results.extend(self._spectra(data[valid, 0], data[valid, channel:channel + 1]))
+        for number, (energies, peak, rms) in enumerate(results):
+            row[1 + number * step:1 + (number + 1) * step] = energies + [peak]
+            levels.append(rms)
+        self.windows += 1
+        if self.level is not None:
+            self.level(levels)
+        return row
+
+    def _spectra(self, times, signals):
+        """ Returns the band energies, peak frequency and RMS of every column of signals """
+        np = self.np
+        count = len(times)
+        if count < 4 or times[-1] <= times[0]:
+            return [([nan] * len(self.bands), nan, nan)] * signals.shape[1]
+        rate = (count - 1) / (times[-1] - times[0])
+        signals = signals - signals.mean(axis=0)
+        taper = np.hanning(count)
+        spectra = np.abs(np.fft.rfft(signals * taper[:, None], axis=0)) ** 2
+        # Scales the one sided spectrum so the bins add up to the mean square of the signal
+        spectra *= 2 / (count * np.sum(taper ** 2))
+        spectra[0] /= 2
+        if count % 2 == 0:
+            spectra[-1] /= 2
+        frequencies = np.fft.rfftfreq(count, 1 / rate)
+        energies = []
+        for low, high in self.bands:
+            if low >= rate / 2:
+                energies.append(np.full(signals.shape[1], nan))
+            else:
+                in_band = (frequencies >= low) & (frequencies < high)
+                energies.append(spectra[in_band].sum(axis=0))
+        energies = np.array(energies)
+        peaks = frequencies[1 + np.argmax(spectra[1:], axis=0)]
+        rms = np.sqrt(spectra.sum(axis=0))
+        return [(energies[:, column].tolist(), float(peaks[column]), float(rms[column]))
+                for column in range(signals.shape[1])]
+
+    def close(self):
+        """ Returns the spectrum of the last, unfinished window. """
+        if self.key is None or not self.pending:
+            return self.np.empty(0)
+        row = self._emit()
+        self.key = None
+        return row
+
+    def stats(self):
+        return {"window": self.window,
+                "bands": self.bands,
+                "channels": self.channels,
+                "rows": self.rows,
+                "windows": self.windows}
@@ -0,0 +1,146 @@
+""" Live statistics of a collection.
+
+The DataCollector times every sensor read and every collection, and the writer
+times the formatting and writing of each batch. The timings are kept in small
+histograms, and a reporter thread publishes them while the collection runs:
+as a JSON file that is replaced every interval, and optionally on a Unix
+socket that returns the current statistics as JSON to every connection, e.g.
+
+    socat - UNIX-CONNECT:/tmp/datacollector.sock
+"""
+from threading import Thread, Event
+import json
+import os
+import socket
+import stat
+
+class Histogram:
+    """ Latency histogram with power of two buckets in microseconds.
+
+    Bucket k counts the values from 2**(k-1) up to 2**k microseconds. """
+
+    size = 32
+
+    def __init__(self):
+        self.counts = [0] * self.size
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        # Called for every sensor read, so it is kept to a few operations
+        bucket = int(seconds * 1e6).bit_length()
+        if bucket >= self.size:
+            bucket = self.size - 1
+        self.counts[bucket] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, fraction):
+        """ Returns the upper bound in seconds of the bucket that holds the given fraction of the values. """
+        limit = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= limit:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        count = self.count
+        return {"count": count,
+                "mean": self.total / count if count else 0.0,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+                "max": self.max,
+                "buckets_us": {2 ** bucket: count for bucket, count in enumerate(self.counts) if count}}
+
+class Stats:
+    """ Named latency histograms, created when a name is first recorded. """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, name, seconds):
+        try:
+            self.histograms[name].add(seconds)
+        except KeyError:
+            self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds)
+
+    def snapshot(self):
+        return {name: histogram.snapshot() for name, histogram in list(self.histograms.items())}
+
+class StatsReporter(Thread):
+    """ Publishes the result of snapshot() to a file and/or a Unix socket. """
+
+    def __init__(self, snapshot, file_name=None, socket_path=None, interval=1.0):
+        super().__init__(daemon=True)
+        self.snapshot = snapshot
+        self.file_name = file_name
+        self.socket_path = socket_path
+        self.interval = interval
+        self.stopped = Event()
+        self.server = None
+        if socket_path:
+            if os.path.lexists(socket_path):
+                # Only the socket of an earlier session is replaced, never a file given by mistake
+                if not _is_socket(socket_path):
+                    raise ValueError("{} exists and is not a socket".format(socket_path))
+                os.remove(socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.server.bind(socket_path)
+            except OSError:
+                self.server.close()
+                raise
+            self.server.listen(4)
+            self.server.settimeout(interval)
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.file_name:
+                self._write_file()
+            if self.server is None:
+                self.stopped.wait(self.interval)
+                continue
+            try:
+                connection, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break # The socket was closed by stop()
+            with connection:
+                try:
+                    connection.sendall(json.dumps(self.snapshot()).encode() + b"\n")
+                except OSError:
+                    pass
+
+    def _write_file(self):
+        """ Replaces the stats file in one step so readers never see half a file """
+        temporary = self.file_name + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temporary, self.file_name)
+
+    def stop(self):
+        """ Stops publishing and removes the stats file and the socket. """
+        self.stopped.set()
+        if self.server is not None:
+            self.server.close()
+        self.join()
+        if self.file_name and os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        if self.socket_path and _is_socket(self.socket_path):
+            os.remove(self.socket_path)
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
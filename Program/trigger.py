@@ -0,0 +1,116 @@
+""" Writes only the collections around events.
+
+For impacts and vibrations only short events matter. With a trigger set, the
+writer passes the collected rows through a Trigger instead of writing them. The
+trigger keeps the last pre seconds of rows in memory, and fires when the
+magnitude of its columns, by default the acceleration in g, reaches the
+threshold. It then writes the kept rows and every row up to post seconds after
+the trigger. A trigger within that time extends it, so a long event is written
+as one piece. The data file only grows with the number of events, and the
+times of the triggers are listed in the statistics.
+
+The rows are checked by the writer, so the check never delays a collection.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import math
+
+accel_columns = ["accel_x", "accel_y", "accel_z"]
+
+class Trigger:
+    """ Passes on the flat rows of width values, the first being the time, from pre seconds
+    before to post seconds after the magnitude of the given columns reaches threshold. """
+
+    max_events = 1000 # Trigger times kept for the statistics
+
+    def __init__(self, columns, threshold, pre=1.0, post=1.0, trigger_columns=accel_columns):
+        missing = [column for column in trigger_columns if column not in columns]
+        if missing:
+            raise ValueError("The trigger needs the columns {}".format(", ".join(missing)))
+        self.width = len(columns)
+        self.out_width = self.width # Rows are written as they are
+        self.indices = [columns.index(column) for column in trigger_columns]
+        self.threshold = threshold
+        self.pre = pre
+        self.post = post
+        self.history = array("d") # Rows of the last pre seconds before a trigger
+        self.until = None # Time up to which rows are written, None if no event is running
+        self.rows = 0 # Rows checked
+        self.written = 0 # Rows passed on
+        self.events = 0 # Number of triggers that started an event
+        self.triggers = [] # Times of the first max_events triggers
+
+    def add(self, values):
+        """ Checks flat rows and returns the ones that belong to an event. """
+        width = self.width
+        rows = len(values) // width
+        out = array("d")
+        times = values[0::width]
+        # The magnitudes of the whole batch are worked out by the builtins
+        magnitudes = map(math.hypot, *(values[index::width] for index in self.indices))
+        threshold = self.threshold
+        hits = [row for row, magnitude in enumerate(magnitudes) if magnitude >= threshold]
+        position = 0
+        hit = 0
+        while position < rows:
+            if self.until is None:
+                while hit < len(hits) and hits[hit] < position:
+                    hit += 1
+                if hit == len(hits):
+                    self._keep(values[position * width:])
+                    break
+                first = hits[hit]
+                self._start(out, values, times, position, first)
+                position = first
+            else:
+                end = bisect_right(times, self.until, position)
+                # Triggers during the event make it longer
+                while hit < len(hits) and hits[hit] < end:
+                    self.until = max(self.until, times[hits[hit]] + self.post)
+                    end = bisect_right(times, self.until, position)
+                    hit += 1
+                out.extend(values[position * width:end * width])
+                position = end
+                if position < rows:
+                    self.until = None
+        self.rows += rows
+        self.written += len(out) // width
+        return out
+
+    def _start(self, out, values, times, position, row):
+        """ Starts an event at row and writes the rows of the pre seconds before it """
+        width = self.width
+        time = times[row]
+        start = time - self.pre
+        history = self.history
+        first = bisect_left(history[0::width], start)
+        out.extend(history[first * width:])
+        del history[:]
+        first = bisect_left(times, start, position, row)
+        out.extend(values[first * width:row * width])
+        self.until = time + self.post
+        self.events += 1
+        if len(self.triggers) < self.max_events:
+            self.triggers.append(time)
+
+    def _keep(self, values):
+        """ Adds rows to the history and drops the rows older than pre seconds """
+        width = self.width
+        history = self.history
+        history.extend(values)
+        if history:
+            first = bisect_left(history[0::width], history[len(history) - width] - self.pre)
+            del history[:first * width]
+
+    def close(self):
+        """ Returns nothing, the rows of an event are passed on as they come. """
+        return array("d")
+
+    def stats(self):
+        return {"threshold": self.threshold,
+                "pre": self.pre,
+                "post": self.post,
+                "rows": self.rows,
+                "written": self.written,
+                "events": self.events,
+                "triggers": self.triggers}
@@ -0,0 +1,311 @@
+from threading import Thread
+from time import monotonic, perf_counter
+from formats import CsvFormat
+from ringbuffer import SampleBuffer, SharedSampleBuffer
+from segments import FileOutput
+from stats import Stats
+import multiprocessing
+import signal
+
+# Policies for when the data file is synced to the SD card
+FSYNC_NEVER = "never"  # Leave it to the operating system
+FSYNC_FLUSH = "flush"  # Sync after every flush
+FSYNC_CLOSE = "close"  # Sync once when the session ends
+
+class StreamWriter(Thread):
+    """ Appends rows to the data file from a background thread.
+
+    Rows are copied into a preallocated ring buffer, so memory use stays flat
+    however long the session runs. If the ring is full the file can not be
+    written as fast as data is collected, which is counted as backpressure.
+    The rows are formatted by the writer thread with the given file format and
+    sent to the output, which is the data file unless another output is given.
+    With a stage the rows are passed through it and what it returns is written
+    instead, see aggregate.py, trigger.py and spectrum.py. """
+
+    def __init__(self, file_name, width, buffer_size=1000, flush_interval=1.0, fsync=FSYNC_CLOSE, block=True,
+                 file_format=None, stats=None, output=None, stage=None, buffer=None):
+        super().__init__(daemon=True)
+        if fsync not in (FSYNC_NEVER, FSYNC_FLUSH, FSYNC_CLOSE):
+            raise ValueError("Unknown fsync policy: {}".format(fsync))
+        self.file_name = file_name
+        self.file_format = file_format or CsvFormat()
+        self.output = output
+        self.stage = stage # An Aggregator, Trigger or Spectrum, or None to write every row
+        self.buffer = buffer if buffer is not None else SampleBuffer(width, buffer_size)
+        self.latency = stats # Records the time spent formatting and writing each batch
+        self.flush_interval = flush_interval # Seconds between flushes to the file
+        self.fsync = fsync
+        self.block = block # Wait for space in a full buffer instead of dropping the row
+        self.rows = 0           # Rows handed to the writer
+        self.written = 0        # Rows written to the file
+        self.bytes = 0          # Bytes written to the file
+        self.dropped = 0        # Rows dropped because the buffer was full
+        self.backpressure = 0   # Number of times the buffer was full
+        self.blocked_time = 0.0 # Seconds spent waiting for a full buffer
+        self.max_depth = 0      # Largest number of rows waiting in the buffer
+        self.flushes = 0
+        self.stopping = False
+        self.error = None
+
+    def write(self, row):
+        """ Copies a row of values into the buffer. """
+        self.rows += 1
+        buffer = self.buffer
+        if buffer.full():
+            self.backpressure += 1
+            if not self.block or self.error is not None:
+                self.dropped += 1
+                return
+            start = monotonic()
+            buffer.wait_for_space()
+            self.blocked_time += monotonic() - start
+        buffer.put(row)
+        depth = len(buffer)
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def close(self):
+        """ Writes the remaining rows and waits for the writer thread to finish. """
+        if self.ident is None:
+            # The thread was never started, e.g. because the asyncio engine drove the writer
+            if self.error is not None:
+                raise self.error
+            self.drain()
+            self.finish()
+            return
+        self.stopping = True
+        self.buffer.ready.set()
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as error:
+            self.error = error
+            # Frees the buffer so the collecting thread is never stuck on it
+            self.buffer.release(len(self.buffer))
+
+    def _run(self):
+        last_flush = monotonic()
+        while True:
+            self.buffer.wait_for_rows(max(last_flush + self.flush_interval - monotonic(), 0.001))
+            # Every row is in the buffer once stopping is set, so this is the last round
+            stopping = self.stopping
+            self.drain()
+            if stopping:
+                self.finish()
+                break
+            if monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = monotonic()
+
+    def open_output(self):
+        """ Returns the output, and opens the data file if no other output was given. """
+        if self.output is None:
+            self.output = FileOutput(self.file_name)
+        return self.output
+
+    def drain(self):
+        """ Formats the rows waiting in the buffer and writes them to the output. """
+        chunks, count = self.buffer.peek()
+        for chunk in chunks:
+            if self.stage is not None:
+                start = perf_counter()
+                chunk = self.stage.add(chunk)
+                self._record("stage", perf_counter() - start)
+            self._write(chunk)
+        self.buffer.release(count)
+        self.written += count
+
+    def _write(self, values):
+        """ Formats flat values and writes them to the output """
+        if not len(values):
+            return
+        width = self.stage.out_width if self.stage is not None else self.buffer.width
+        start = perf_counter()
+        data = self.file_format.encode(values, width)
+        formatted = perf_counter()
+        self.open_output().write(data, values[0], values[len(values) - width], len(values) // width)
+        self._record("format", formatted - start)
+        self._record("write", perf_counter() - formatted)
+        self.bytes += len(data)
+
+    def flush(self):
+        """ Flushes the output, and syncs it if the fsync policy says so. """
+        start = perf_counter()
+        self.open_output().flush(self.fsync == FSYNC_FLUSH)
+        self._record("flush", perf_counter() - start)
+        self.flushes += 1
+
+    def finish(self):
+        """ Closes the output at the end of the session. """
+        if self.stage is not None:
+            # Writes what the stage holds back, e.g. the last window of an Aggregator
+            self._write(self.stage.close())
+        start = perf_counter()
+        self.open_output().close(self.fsync in (FSYNC_FLUSH, FSYNC_CLOSE))
+        self._record("flush", perf_counter() - start)
+        self.flushes += 1
+
+    def _record(self, name, seconds):
+        if self.latency is not None:
+            self.latency.record(name, seconds)
+
+    def stats(self):
+        """ Returns a dictionary with the writer statistics of the session. """
+        return {"rows": self.rows,
+                "written": self.written,
+                "bytes": self.bytes,
+                "dropped": self.dropped,
+                "backpressure": self.backpressure,
+                "blocked_time": self.blocked_time,
+                "depth": len(self.buffer),
+                "max_depth": self.max_depth,
+                "buffer_size": self.buffer.capacity,
+                "flushes": self.flushes,
+                "fsync": self.fsync,
+                "stage": self.stage.stats() if self.stage is not None else None,
+                "output": self.output.stats() if hasattr(self.output, "stats") else None}
+
+class ProcessWriter(StreamWriter):
+    """ StreamWriter that formats and writes the rows in a child process.
+
+    The rows are put into a SharedSampleBuffer, and a forked process does the
+    formatting, compression and writing, so none of it holds the GIL of the
+    collecting process. The counters of the child are sent back when it is
+    closed, until then written follows the rows the child has released. The
+    stage runs in the child, so its statistics are only known then as well. """
+
+    context = multiprocessing.get_context("fork")
+    check_interval = 0.1 # Seconds between checks that the child is alive while the buffer is full
+
+    def __init__(self, file_name, width, buffer_size=1000, *args, **kwargs):
+        # Set before StreamWriter.__init__, which sets stopping and error
+        self.stopped = self.context.Event()
+        self.terminated = False # Set by the SIGTERM handler of the child
+        self.failed = self.context.Event()
+        self._error = None
+        buffer = SharedSampleBuffer(width, buffer_size, self.context)
+        super().__init__(file_name, width, buffer_size, *args, buffer=buffer, **kwargs)
+        self.receiver, self.sender = self.context.Pipe(duplex=False)
+        self.process = None
+        self.stage_stats = None # Statistics of the stage, which runs in the child
+        self.output_stats = None # Statistics of the output, e.g. a NetworkOutput, which also runs in the child
+
+    @property
+    def stopping(self):
+        return self.terminated or self.stopped.is_set()
+
+    @stopping.setter
+    def stopping(self, value):
+        if value:
+            self.stopped.set()
+
+    @property
+    def error(self):
+        if self._error is None and self.failed.is_set():
+            return RuntimeError("The writer process failed")
+        return self._error
+
+    @error.setter
+    def error(self, value):
+        self._error = value
+        if value is not None:
+            self.failed.set()
+
+    def write(self, row):
+        """ Copies a row of values into the buffer. While the buffer is full the child is checked
+        every check_interval, so a child that was killed fails the writer instead of blocking it. """
+        buffer = self.buffer
+        if not (buffer.full() and self.block and self.error is None and self.process is not None):
+            super().write(row)
+            return
+        self.rows += 1
+        self.backpressure += 1
+        start = monotonic()
+        while not buffer.wait_for_space(self.check_interval):
+            if not self.process.is_alive():
+                self.error = RuntimeError("The writer process ended with exit code {}".format(self.process.exitcode))
+                break
+        self.blocked_time += monotonic() - start
+        if self.error is not None:
+            self.dropped += 1
+            return
+        buffer.put(row)
+        depth = len(buffer)
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def start(self):
+        self.process = self.context.Process(target=self._consume, name="DataCollector writer", daemon=True)
+        self.process.start()
+
+    def _consume(self):
+        """ Runs in the child process """
+        # The collecting process stops the writer, so it keeps writing until then
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # multiprocessing terminates the child when the collecting process exits without closing the writer
+        signal.signal(signal.SIGTERM, self._terminate)
+        self.latency = Stats()
+        self.run()
+        result = {"written": self.written,
+                  "bytes": self.bytes,
+                  "flushes": self.flushes,
+                  "histograms": self.latency.histograms,
+                  "stage": self.stage.stats() if self.stage is not None else None,
+                  "output": self.output.stats() if hasattr(self.output, "stats") else None,
+                  "error": self._error}
+        try:
+            self.sender.send(result)
+        except Exception:
+            # The error could not be pickled
+            result["error"] = RuntimeError(repr(self._error))
+            self.sender.send(result)
+
+    def _terminate(self, signum, frame):
+        """ Stops the child as close does, without the lock of the stopped event """
+        self.terminated = True
+        self.buffer.ready.set()
+
+    def close(self):
+        """ Stops the writer process, waits for it to write the remaining rows and frees the buffer. """
+        if self.process is None:
+            super().close()
+            self.buffer.close()
+            return
+        self.stopping = True
+        self.buffer.ready.set()
+        try:
+            while not self.receiver.poll(0.1):
+                if not self.process.is_alive():
+                    raise RuntimeError("The writer process ended with exit code {}".format(self.process.exitcode))
+            result = self.receiver.recv()
+        finally:
+            self.process.join()
+            self.buffer.close()
+        self.written = result["written"]
+        self.bytes = result["bytes"]
+        self.flushes = result["flushes"]
+        self._error = result["error"]
+        if self.latency is not None:
+            for name, histogram in result["histograms"].items():
+                self.latency.histograms.setdefault(name, histogram)
+        self.stage_stats = result["stage"]
+        self.output_stats = result["output"]
+        if self._error is not None:
+            raise self._error
+
+    def stats(self):
+        stats = super().stats()
+        if self.process is not None and self.process.exitcode is None:
+            stats["written"] = self.buffer.tail
+            # The stage of this process is a copy that the child does not update
+            stats["stage"] = None
+        if self.stage_stats is not None:
+            stats["stage"] = self.stage_stats
+        if self.output_stats is not None:
+            stats["output"] = self.output_stats
+        return stats